@@ -5,6 +5,7 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+import argparse
 import asyncio
 import json
 import time
@@ -12,13 +13,18 @@ import datetime
 import traceback
 import uuid
 import re
-import importlib
+import aiohttp
 from aiohttp import web
 from metaverse import login
 from metaverse.bot import SimpleBot
+from metaverse.httpclient import getDefaultClient, closeDefaultClient
+from metaverse.supervisor import Supervisor, loadCallable
 from metaverse.viewer import messages
+from metaverse.viewer.transport import getDefaultPool
 from metaverse.const import *
 
+WEB_PORT = 26875
+
 def loadDictIntoMessage(msg, data):
     for name, block in data.items():
         if type(data[name]) == list:
@@ -70,7 +76,8 @@ class BotInstance:
     async def run(self):
         while True:
             try:
-                bot = SimpleBot()
+                # All bots share a few UDP sockets rather than one per region
+                bot = SimpleBot(socketPool = getDefaultPool())
                 self.bot = bot
                 self.routes = []
                 for feature in self.features:
@@ -87,58 +94,39 @@ class BotInstance:
             except asyncio.exceptions.CancelledError as e:
                 break
 
-def load_callable(path: str):
-    """Loads a function or object from a string like 'package.module:func'."""
-    if ':' not in path:
-        raise ValueError(f"Invalid path '{path}', expected format 'module.submodule:function'")
-    
-    module_path, func_name = path.split(':', 1)
-    module = importlib.import_module(module_path)
-    
-    try:
-        return getattr(module, func_name)
-    except AttributeError:
-        raise ImportError(f"Function '{func_name}' not found in module '{module_path}'")
-
-async def main():
-    with open("bots.json", "r") as f:
-        bots = json.load(f)
-
+def loadInstances(configs):
     instances = []
-    for bot in bots:
+    for bot in configs:
         if bot.get("disabled", False) == True:
             continue
 
         functions = []
         for function_path in bot.get("functions", []):
-            functions.append(load_callable(function_path))
+            functions.append(loadCallable(function_path))
         instance = BotInstance(bot["username"], bot["password"], functions)
         instances.append(instance)
+    return instances
+
+def findInstance(instances, uuid_str):
+    try:
+        bot_uuid = str(uuid.UUID(uuid_str))
+        for instance in instances:
+            if instance.bot and instance.bot.agent.agentId == uuid_str:
+                return instance
+    
+    except ValueError:
+        for instance in instances:
+            if instance.bot and ".".join(instance.bot.agent.username).lower() == uuid_str.lower():
+                return instance
+    
+    return None
 
+def makeApp(instances):
     async def handle_bot_request(request):
         uuid_str = request.match_info['uuid']
         path = request.match_info.get('path', "")
         
-        bot = None
-        try:
-            bot_uuid = str(uuid.UUID(uuid_str))
-            for instance in instances:
-                try:
-                    if instance.bot.agent.agentId == uuid_str:
-                        bot = instance
-                        break
-                except Exception as e:
-                    raise e
-        
-        except ValueError:
-            for instance in instances:
-                try:
-                    if ".".join(instance.bot.agent.username).lower() == uuid_str.lower():
-                        bot = instance
-                        break
-                except Exception as e:
-                    raise e
-
+        bot = findInstance(instances, uuid_str)
         if bot:
             return await bot.handle_request(request, path)
         
@@ -150,27 +138,133 @@ async def main():
     async def handle_bot_index(request):
         response = {}
         for instance in instances:
+            if not instance.bot:
+                continue
             response[instance.bot.agent.agentId] = {
                 "username": list(instance.bot.agent.username) if instance.bot.agent.username != (None, None) else []
             }
             
         return web.Response(status=200, text=json.dumps(response))
     
-    async def run_web_server():
-        app = web.Application()
-        app.router.add_get('/bot/{uuid}/{path:.*}', handle_bot_request)
-        app.router.add_get('/bot/{uuid}', handle_bot_request)
-        app.router.add_get('/bot', handle_bot_index)
-        runner = web.AppRunner(app)
-        await runner.setup()
-        site = web.TCPSite(runner, 'localhost', 26875)
-        await site.start()
+    app = web.Application()
+    app.router.add_get('/bot/{uuid}/{path:.*}', handle_bot_request)
+    app.router.add_get('/bot/{uuid}', handle_bot_request)
+    app.router.add_get('/bot', handle_bot_index)
+    return app
+
+async def run_web_server(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', port)
+    await site.start()
+
+async def worker(context):
+    """Runs a shard of the bots inside a supervisor worker process."""
+    instances = loadInstances(context.configs)
+    tasks = [asyncio.create_task(instance.run()) for instance in instances]
+    
+    def report():
+        bots = {}
+        for instance in instances:
+            if not instance.bot or not instance.bot.agent.agentId:
+                continue
+            username = instance.bot.agent.username
+            bots[str(instance.bot.agent.agentId)] = {
+                "username": list(username) if username != (None, None) else [],
+                "aliases": [".".join(username).lower()] if username != (None, None) else [],
+                "metrics": instance.bot.getMetrics()
+            }
+        return {
+            "bots": bots,
+            "metrics": {
+                "sockets": getDefaultPool().getMetrics(),
+                "http": getDefaultClient().scheduler.getMetrics()
+            }
+        }
+    context.reporter = report
+    
+    @context.on("Add")
+    def add(configs):
+        for instance in loadInstances(configs):
+            instances.append(instance)
+            tasks.append(asyncio.create_task(instance.run()))
+    
+    try:
+        await run_web_server(makeApp(instances), context.port)
+        await asyncio.Event().wait()
+    finally:
+        await closeDefaultClient()
+
+async def supervise(workers):
+    with open("bots.json", "r") as f:
+        bots = json.load(f)
+    
+    supervisor = Supervisor(worker, bots, workers, basePort=WEB_PORT)
+    # Plain session for talking to our own workers, the scheduler of the
+    # default client would queue these behind unrelated requests
+    proxy = aiohttp.ClientSession()
+    
+    async def handle_bot_request(request):
+        owner = supervisor.findWorker(request.match_info['uuid'])
+        if not owner:
+            return web.Response(status=404, text="Bot not found")
+        
+        # Hand it to the web server of the worker running the bot
+        url = "http://localhost:{}{}".format(owner.port, request.rel_url)
+        async with proxy.get(url) as response:
+            return web.Response(
+                status=response.status,
+                body=await response.read(),
+                content_type=response.headers.get("Content-Type", "text/plain").split(";")[0]
+            )
+    
+    async def handle_bot_index(request):
+        response = {}
+        for health in supervisor.getHealth().values():
+            for agentId, info in health["bots"].items():
+                response[agentId] = {"username": info["username"]}
+        return web.Response(status=200, text=json.dumps(response))
+    
+    async def handle_health(request):
+        return web.Response(status=200, text=json.dumps(supervisor.getHealth()))
+    
+    app = web.Application()
+    app.router.add_get('/bot/{uuid}/{path:.*}', handle_bot_request)
+    app.router.add_get('/bot/{uuid}', handle_bot_request)
+    app.router.add_get('/bot', handle_bot_index)
+    app.router.add_get('/health', handle_health)
+    
+    try:
+        await asyncio.gather(
+            run_web_server(app, WEB_PORT),
+            supervisor.run()
+        )
+    finally:
+        await proxy.close()
+
+async def main():
+    with open("bots.json", "r") as f:
+        bots = json.load(f)
+
+    instances = loadInstances(bots)
     
     # Launch both the web server and bots
-    await asyncio.gather(
-        run_web_server(),
-        *[instance.run() for instance in instances]
-    )
+    try:
+        await asyncio.gather(
+            run_web_server(makeApp(instances), WEB_PORT),
+            *[instance.run() for instance in instances]
+        )
+    finally:
+        await closeDefaultClient()
 
-# Run everything
-asyncio.run(main())
+# Run everything, worker processes import this file too
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=0,
+        help="Spread the bots over this many processes, 0 runs them all in this one")
+    args = parser.parse_args()
+    
+    if args.workers:
+        asyncio.run(supervise(args.workers))
+    else:
+        asyncio.run(main())
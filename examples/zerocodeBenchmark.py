@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Zero coding speed on a typical ObjectUpdate
+import time
+import uuid
+from metaverse.viewer import messages
+from metaverse.viewer.zerocode import zeroEncode, zeroDecode
+
+def benchmark(count = 10000):
+    # Roughly what a simulator sends for a handful of plain prims
+    template = messages.getDefaultTemplate()
+    msg = template.getMessage("ObjectUpdate")
+    msg.RegionData.RegionHandle = (256000 << 32) | 256000
+    msg.RegionData.TimeDilation = 0xFFFF
+    for i in range(4):
+        block = msg.ObjectData[i]
+        block.ID = 1000 + i
+        block.FullID = uuid.uuid4()
+        block.CRC = 1
+        block.PCode = 9
+        block.Material = 3
+        block.Scale = (0.5, 0.5, 0.5)
+        block.ObjectData = bytes(60)
+        block.UpdateFlags = 0x10000000
+        block.PathCurve = 16
+        block.ProfileCurve = 1
+        block.PathScaleX = 100
+        block.PathScaleY = 100
+        block.TextureEntry = uuid.uuid4().bytes + bytes(30)
+        block.OwnerID = uuid.uuid4()
+
+    decoded = bytes(msg)
+    encoded = zeroEncode(decoded)
+    if zeroDecode(encoded) != decoded:
+        raise Exception("Zero coding did not round trip")
+
+    print("ObjectUpdate: {} bytes, {} bytes zero coded".format(len(decoded), len(encoded)))
+    for name, func, data in (
+        ("zeroEncode", zeroEncode, decoded),
+        ("zeroDecode", zeroDecode, encoded)
+    ):
+        start = time.perf_counter()
+        for _ in range(count):
+            func(data)
+        elapsed = time.perf_counter() - start
+        print("{}: {:.2f}us per call, {:.1f}MB/s".format(
+            name,
+            elapsed / count * 1000000,
+            len(data) * count / elapsed / 1000000
+        ))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,5 +1,4 @@
 import asyncio
-import struct
 import math
 import random
 import datetime
@@ -13,10 +12,17 @@ import logging
 logger = logging.getLogger(__name__)
 
 class SimpleBot(EventTarget):
-    def __init__(self):
+    # Messages handled by handleSystemMessages
+    SYSTEM_MESSAGES = frozenset((
+        "RegionHandshake",
+        "ImprovedInstantMessage"
+    ))
+    
+    def __init__(self, socketPool = None):
         super().__init__()
         self.agent = Viewer.Agent()
-        self.agent.on("Message", self.handleMessage)
+        self.agent.socketPool = socketPool
+        self.agent.on("Message", self.handleMessage, interest=self.wantsMessage)
         self.agent.on("Event", self.handleEvent)
         self.lastAgentUpdate = None
     
@@ -27,22 +33,7 @@ class SimpleBot(EventTarget):
         
         if message.name == "RegionHandshake":
             # Send some stuff to make the simulator happy about our presence
-            msg = self.messageTemplate.getMessage("AgentThrottle")
-            msg.AgentData.AgentID = self.agent.agentId
-            msg.AgentData.SessionID = self.agent.sessionId
-            msg.AgentData.CircuitCode = self.agent.circuitCode
-            msg.Throttle.GenCounter = 0
-            msg.Throttle.Throttles = struct.pack("<7f",
-                #http://wiki.secondlife.com/wiki/AgentThrottle
-                150000,  #Resend
-                170000,  #Land
-                34000,   #Wind
-                34000,   #Cloud
-                446000,  #Task
-                446000,  #Texture
-                220000   #Asset
-            )
-            self.send(msg)
+            self.agent.sendThrottles(simulator)
             
             msg = self.messageTemplate.getMessage("AgentFOV")
             msg.AgentData.AgentID = self.agent.agentId
@@ -112,6 +103,9 @@ class SimpleBot(EventTarget):
         await self.handleSystemEvent(sim, name, body)
         await self.fire("Event", sim, name, body, name=name)
 
+    def wantsMessage(self, name):
+        return name in self.SYSTEM_MESSAGES or self.hasListeners("Message", name=name)
+    
     async def handleMessage(self, simulator, message):
         await self.handleSystemMessages(simulator, message)
         await self.fire("Message", simulator, message, name=message.name)
@@ -119,7 +113,11 @@ class SimpleBot(EventTarget):
     def send(self, message, reliable = False):
         self.agent.send(message, reliable)
     
+    def getMetrics(self):
+        return self.agent.getMetrics()
+    
     async def login(self, *args, **kwargs):
+        kwargs.setdefault("client", self.agent.http)
         loginHandle = await login.Login(*args, **kwargs, isBot = True)
         if loginHandle["login"] == "false":
             logger.critical("Login failure: {}".format(loginHandle["message"]))
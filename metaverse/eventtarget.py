@@ -1,33 +1,346 @@
 import asyncio
+import heapq
 import inspect
+from collections import deque
+from enum import Enum, auto
+
+import logging
+logger = logging.getLogger(__name__)
 
 class EventTargetListener:
-    def __init__(self, func, filters=None, once=False):
+    def __init__(self, func, filters=None, once=False, interest=None, timeout=None):
         self.func = func
         self.filters = filters or {}
         self.once = once
+        # Seconds an async listener may take in concurrent mode
+        self.timeout = timeout
+        # Listeners that re-fire events elsewhere can narrow down what they
+        # actually want, see EventTarget.hasListeners
+        self.interest = interest
+        self.isAsync = inspect.iscoroutinefunction(func)
+        # Registration order, set by EventTargetIndex
+        self.order = 0
+        # Filters left to check after the index lookup
+        self.rest = {k: v for k, v in self.filters.items() if k != EventTargetIndex.KEY}
 
     def test(self, event_kwargs):
         return all(event_kwargs.get(k) == v for k, v in self.filters.items())
 
+    def testRest(self, event_kwargs):
+        for k, v in self.rest.items():
+            if event_kwargs.get(k) != v:
+                return False
+        return True
+
     def __call__(self, *args, **kwargs):
         return self.func(*args, **kwargs)
 
     def is_async(self):
-        return inspect.iscoroutinefunction(self.func)
+        return self.isAsync
+
+
+class EventTargetIndex:
+    """
+    Listeners of one event, indexed by the value of their KEY filter. Dicts
+    are used as ordered sets so that removal is O(1).
+    """
+    KEY = "name"
+
+    def __init__(self):
+        self.keyed = {}   # filter value -> {listener: None}
+        self.wild = {}    # listeners without a KEY filter
+        self.funcs = {}   # func -> {listener: None}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.wild) + sum(len(bucket) for bucket in self.keyed.values())
+
+    def __bool__(self):
+        return bool(self.wild or self.keyed)
+
+    def add(self, listener):
+        self.counter += 1
+        listener.order = self.counter
+        if self.KEY in listener.filters:
+            self.keyed.setdefault(listener.filters[self.KEY], {})[listener] = None
+        else:
+            self.wild[listener] = None
+        self.funcs.setdefault(listener.func, {})[listener] = None
+
+    def remove(self, listener):
+        if self.KEY in listener.filters:
+            value = listener.filters[self.KEY]
+            bucket = self.keyed.get(value)
+            if bucket is None or bucket.pop(listener, False) is False:
+                return
+            if not bucket:
+                del self.keyed[value]
+        elif self.wild.pop(listener, False) is False:
+            return
+
+        listeners = self.funcs[listener.func]
+        del listeners[listener]
+        if not listeners:
+            del self.funcs[listener.func]
+
+    def removeFunc(self, func):
+        for listener in list(self.funcs.get(func, ())):
+            self.remove(listener)
+
+    def candidates(self, event_kwargs):
+        """Listeners whose KEY filter matches, in registration order."""
+        keyed = self.keyed.get(event_kwargs.get(self.KEY)) if self.keyed else None
+        if not keyed:
+            return list(self.wild)
+        if not self.wild:
+            return list(keyed)
+        return list(heapq.merge(keyed, self.wild, key=lambda listener: listener.order))
+
+    def match(self, event_kwargs):
+        return [listener for listener in self.candidates(event_kwargs) if listener.testRest(event_kwargs)]
+
+
+class EventTargetDispatcher:
+    """
+    Runs listeners as tasks so that fire() doesn't wait for them. Events that
+    share an ordering key are handled one after another, different keys run
+    side by side, at most limit listeners at a time.
+    """
+    class ORDER(Enum):
+        # Every listener call is independent
+        NONE = auto()
+        # Events of the same type are handled in order
+        EVENT = auto()
+        # Events of the same type and name are handled in order
+        NAME = auto()
+
+    def __init__(self, limit=16, timeout=None, slow=1.0, ordering=None):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.timeout = timeout
+        self.slow = slow
+        self.ordering = ordering or self.ORDER.NAME
+        self.lanes = {}
+        self.tasks = set()
+        self.timeouts = 0
+        self.errors = 0
+        self.slowCalls = 0
+
+    def spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def submit(self, event, listeners, args, kwargs):
+        if self.ordering == self.ORDER.NONE:
+            for listener in listeners:
+                self.spawn(self.call(event, listener, args))
+            return
+
+        if self.ordering == self.ORDER.EVENT:
+            key = event
+        else:
+            key = (event, kwargs.get(EventTargetIndex.KEY))
+
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = deque()
+            self.spawn(self.drain(key, lane))
+        lane.append((event, listeners, args))
+
+    async def drain(self, key, lane):
+        try:
+            while lane:
+                event, listeners, args = lane.popleft()
+                for listener in listeners:
+                    await self.call(event, listener, args)
+        finally:
+            del self.lanes[key]
+
+    async def call(self, event, listener, args):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                if listener.isAsync:
+                    timeout = listener.timeout or self.timeout
+                    if timeout:
+                        await asyncio.wait_for(listener(*args), timeout)
+                    else:
+                        await listener(*args)
+                else:
+                    listener(*args)
+
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logger.warning(f"Listener {listener.func.__qualname__} for {event} timed out")
+
+            except Exception:
+                self.errors += 1
+                logger.exception(f"Listener {listener.func.__qualname__} for {event} failed")
+
+            elapsed = loop.time() - start
+            if self.slow and elapsed > self.slow:
+                self.slowCalls += 1
+                logger.warning(f"Slow listener {listener.func.__qualname__} for {event} took {elapsed:.3f}s")
+
+    async def join(self):
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+class EventStream:
+    """
+    Buffers fired events for consumption with async for or in batches. Each
+    item is the tuple of event arguments, or the argument itself if there is
+    only one.
+    """
+    class POLICY(Enum):
+        # Make room by dropping the oldest buffered item
+        DROP_OLDEST = auto()
+        # Drop the new item
+        DROP_NEWEST = auto()
+        # Make fire() wait until there is room
+        BACKPRESSURE = auto()
+
+    def __init__(self, target, event, maxsize=1024, policy=None, **filters):
+        self.target = target
+        self.event = event
+        self.maxsize = maxsize
+        self.policy = policy or self.POLICY.DROP_OLDEST
+        self.items = deque()
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+        self.space.set()
+        self.closed = False
+        self.dropped = 0
+        self.highWater = 0
+
+        if self.policy == self.POLICY.BACKPRESSURE:
+            target.on(event, self.putWait, **filters)
+        else:
+            target.on(event, self.put, **filters)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except EOFError:
+            raise StopAsyncIteration
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def put(self, *args):
+        if self.closed:
+            return
+
+        if len(self.items) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == self.POLICY.DROP_NEWEST:
+                return
+            self.items.popleft()
+
+        self.items.append(args[0] if len(args) == 1 else args)
+        if len(self.items) > self.highWater:
+            self.highWater = len(self.items)
+        self.ready.set()
+
+    async def putWait(self, *args):
+        while len(self.items) >= self.maxsize and not self.closed:
+            self.space.clear()
+            await self.space.wait()
+        self.put(*args)
+
+    def take(self, count):
+        items = self.items
+        batch = [items.popleft() for _ in range(min(count, len(items)))]
+        if not items:
+            self.ready.clear()
+        if len(items) < self.maxsize:
+            self.space.set()
+        return batch
+
+    async def get(self):
+        """Next item, raises EOFError once the stream is closed and drained."""
+        while not self.items:
+            if self.closed:
+                raise EOFError("Stream closed")
+            await self.ready.wait()
+
+        return self.take(1)[0]
+
+    async def get_batch(self, count, timeout=None):
+        """
+        Up to count items. Waits until count items are buffered or timeout
+        seconds passed, whichever comes first, and returns whatever is there.
+        """
+        if timeout is None:
+            if not self.items and not self.closed:
+                await self.ready.wait()
+            return self.take(count)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self.items) < count and not self.closed:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        if self.items:
+            self.ready.set()
+        return self.take(count)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.target.off(self.event, self.put)
+        self.target.off(self.event, self.putWait)
+        self.ready.set()
+        self.space.set()
 
 
 class EventTarget:
     def __init__(self):
-        self._listeners = {}  # event -> list of EventTargetListener
+        self._listeners = {}  # event -> EventTargetIndex
+        self._dispatcher = None
+
+    def setConcurrency(self, limit=16, timeout=None, slow=1.0, ordering=None):
+        """
+        Let fire() hand listeners off to an EventTargetDispatcher instead of
+        awaiting them one by one. A limit of None goes back to that.
+        """
+        if self._dispatcher:
+            self._dispatcher.close()
+        self._dispatcher = EventTargetDispatcher(limit, timeout, slow, ordering) if limit else None
+        return self._dispatcher
 
-    def on(self, event, func=None, once=False, **filters):
+    def on(self, event, func=None, once=False, interest=None, timeout=None, **filters):
         if event not in self._listeners:
-            self._listeners[event] = []
+            self._listeners[event] = EventTargetIndex()
 
         def decorator(f):
-            listener = EventTargetListener(f, filters, once)
-            self._listeners[event].append(listener)
+            listener = EventTargetListener(f, filters, once, interest, timeout)
+            self._listeners[event].add(listener)
             return f
 
         return decorator(func) if func else decorator
@@ -37,39 +350,54 @@ class EventTarget:
 
     def off(self, event, func):
         if event in self._listeners:
-            self._listeners[event] = [
-                listener for listener in self._listeners[event]
-                if listener.func != func
-            ]
+            self._listeners[event].removeFunc(func)
+
+    def hasListeners(self, event, **kwargs):
+        """Check if firing event with these keyword arguments would reach anyone."""
+        index = self._listeners.get(event)
+        if not index:
+            return False
+
+        for listener in index.match(kwargs):
+            if listener.interest is None or listener.interest(**kwargs):
+                return True
+        return False
 
     async def fire(self, event, *args, **kwargs):
-        listeners = self._listeners.get(event, [])
-        to_remove = []
+        index = self._listeners.get(event)
+        if not index:
+            return
 
-        for listener in list(listeners):  # shallow copy to allow mutation
-            if listener.test(kwargs):
-                if listener.is_async():
-                    await listener(*args)
-                else:
-                    listener(*args)
+        # match() returns a new list, listeners may come and go meanwhile
+        listeners = index.match(kwargs)
+        if self._dispatcher and listeners:
+            for listener in listeners:
                 if listener.once:
-                    to_remove.append(listener)
+                    index.remove(listener)
+            self._dispatcher.submit(event, listeners, args, kwargs)
+            return
 
-        for listener in to_remove:
-            self._listeners[event].remove(listener)
+        for listener in listeners:
+            if listener.once:
+                index.remove(listener)
+            if listener.isAsync:
+                await listener(*args)
+            else:
+                listener(*args)
 
     def fireSync(self, event, *args, **kwargs):
-        listeners = self._listeners.get(event, [])
-        to_remove = []
+        index = self._listeners.get(event)
+        if not index:
+            return
 
-        for listener in list(listeners):
-            if listener.test(kwargs):
-                listener(*args)
-                if listener.once:
-                    to_remove.append(listener)
+        for listener in index.match(kwargs):
+            if listener.once:
+                index.remove(listener)
+            listener(*args)
 
-        for listener in to_remove:
-            self._listeners[event].remove(listener)
+    def stream(self, event, maxsize=1024, policy=None, **filters):
+        """Subscribe to an event through an EventStream."""
+        return EventStream(self, event, maxsize, policy, **filters)
 
     async def waitFor(self, event, timeout=None, **filters):
         future = asyncio.get_event_loop().create_future()
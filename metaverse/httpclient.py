@@ -1,14 +1,206 @@
+import asyncio
+import email.utils
+import time
+from enum import IntEnum
+from urllib.parse import urlsplit
 import aiohttp
 
+# What a request can fail with before there is any response
+NETWORK_ERRORS = (aiohttp.ClientError, OSError)
+
+class HttpError(Exception):
+    def __init__(self, status, headers = None):
+        super().__init__(f"HTTP status {status}")
+        self.status = status
+        self.headers = headers or {}
+    
+    @property
+    def retryAfter(self):
+        """Seconds the server asked us to wait, or None."""
+        return parseRetryAfter(self.headers.get("Retry-After"))
+
+def parseRetryAfter(value):
+    if not value:
+        return None
+    
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+class RequestSlot:
+    __slots__ = ("host", "capability", "priority", "queued", "future")
+    
+    def __init__(self, host, capability, priority, queued):
+        self.host = host
+        self.capability = capability
+        self.priority = priority
+        self.queued = queued
+        self.future = None
+
+class HostState:
+    def __init__(self):
+        self.active = 0
+        self.capabilities = {}
+        self.waiting = []
+        self.blockedUntil = 0
+        self.wakeTimer = None
+        # Metrics
+        self.requests = 0
+        self.throttled = 0
+        self.maxQueued = 0
+        self.waited = 0.0
+
+class RequestScheduler:
+    """
+    Limits how many requests run at once per host and per capability on that
+    host. Requests over the limit wait their turn by priority, and hosts that
+    answer 429 or 503 are left alone for as long as they ask to.
+    """
+    class PRIORITY(IntEnum):
+        # Event queue polls mostly sit idle on the server, they don't count
+        # towards the limits and never wait behind anything
+        POLL = 0
+        HIGH = 1
+        NORMAL = 2
+        LOW = 3
+    
+    PER_HOST = 6
+    PER_CAPABILITY = 2
+    # Seconds to back off when a throttling response has no Retry-After
+    RETRY_DEFAULT = 1.0
+    
+    def __init__(self, perHost = None, perCapability = None):
+        self.perHost = perHost or self.PER_HOST
+        self.perCapability = perCapability or self.PER_CAPABILITY
+        self.hosts = {}
+        self.counter = 0
+    
+    def canRun(self, state, slot):
+        if slot.priority == self.PRIORITY.POLL:
+            return True
+        return state.active < self.perHost and state.capabilities.get(slot.capability, 0) < self.perCapability
+    
+    def grant(self, state, slot):
+        state.requests += 1
+        state.waited += time.monotonic() - slot.queued
+        if slot.priority != self.PRIORITY.POLL:
+            state.active += 1
+            state.capabilities[slot.capability] = state.capabilities.get(slot.capability, 0) + 1
+    
+    async def acquire(self, host, capability = None, priority = None):
+        if priority == None:
+            priority = self.PRIORITY.NORMAL
+        
+        state = self.hosts.get(host)
+        if not state:
+            state = self.hosts[host] = HostState()
+        
+        slot = RequestSlot(host, capability, priority, time.monotonic())
+        if not state.waiting and state.blockedUntil <= slot.queued and self.canRun(state, slot):
+            self.grant(state, slot)
+            return slot
+        
+        self.counter += 1
+        slot.future = asyncio.get_running_loop().create_future()
+        state.waiting.append((priority, self.counter, slot))
+        state.waiting.sort(key = lambda entry: entry[:2])
+        state.maxQueued = max(state.maxQueued, len(state.waiting))
+        self.wake(state)
+        
+        try:
+            await slot.future
+        except asyncio.CancelledError:
+            if slot.future.done() and not slot.future.cancelled():
+                # Got the slot just as we were cancelled, give it back
+                self.release(slot)
+            else:
+                state.waiting = [entry for entry in state.waiting if entry[2] is not slot]
+            raise
+        
+        return slot
+    
+    def release(self, slot, status = None, headers = None):
+        state = self.hosts[slot.host]
+        if slot.priority != self.PRIORITY.POLL:
+            state.active -= 1
+            state.capabilities[slot.capability] -= 1
+            if not state.capabilities[slot.capability]:
+                del state.capabilities[slot.capability]
+        
+        if status in (429, 503):
+            state.throttled += 1
+            delay = parseRetryAfter((headers or {}).get("Retry-After"))
+            state.blockedUntil = max(state.blockedUntil, time.monotonic() + (delay if delay != None else self.RETRY_DEFAULT))
+        
+        self.wake(state)
+    
+    def wake(self, state):
+        if not state.waiting:
+            return
+        
+        now = time.monotonic()
+        if state.blockedUntil > now:
+            if not state.wakeTimer:
+                def timer():
+                    state.wakeTimer = None
+                    self.wake(state)
+                state.wakeTimer = asyncio.get_running_loop().call_later(state.blockedUntil - now, timer)
+            return
+        
+        remaining = []
+        for entry in state.waiting:
+            slot = entry[2]
+            if slot.future.done():
+                continue
+            if self.canRun(state, slot):
+                self.grant(state, slot)
+                slot.future.set_result(True)
+            else:
+                remaining.append(entry)
+        state.waiting = remaining
+    
+    def getMetrics(self):
+        result = {}
+        for host, state in self.hosts.items():
+            result[host] = {
+                "active": state.active,
+                "queued": len(state.waiting),
+                "maxQueued": state.maxQueued,
+                "requests": state.requests,
+                "throttled": state.throttled,
+                "averageWait": state.waited / state.requests if state.requests else 0.0
+            }
+        return result
+
 class HttpResponse:
-    def __init__(self, handle):
+    def __init__(self, handle, scheduler = None, slot = None):
         self._handle = handle
+        self._scheduler = scheduler
+        self._slot = slot
     
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        self._handle.close()
+        self.release()
+    
+    def release(self):
+        """
+        Hand the connection back to the pool rather than closing it, and the
+        scheduler slot back to the scheduler. Reading the whole body does this
+        too, for callers that don't use the response as a context manager.
+        """
+        self._handle.release()
+        if self._slot:
+            slot = self._slot
+            self._slot = None
+            self._scheduler.release(slot, self.status, self.headers)
     
     @property
     def status(self):
@@ -18,44 +210,135 @@ class HttpResponse:
     def headers(self):
         return self._handle.headers
     
+    def __del__(self):
+        # Dropped without reading the body or closing it, the slot would be
+        # gone for good otherwise
+        if self._slot:
+            self.release()
+    
     async def read(self):
-        return await self._handle.read()
+        try:
+            return await self._handle.read()
+        finally:
+            self.release()
+    
+    async def iterChunks(self, size = 65536):
+        """Body as it arrives, for decoding large responses incrementally."""
+        try:
+            async for chunk in self._handle.content.iter_chunked(size):
+                yield chunk
+        finally:
+            self.release()
 
 class HttpClient:
-    def __init__(self):
+    """
+    Wraps an aiohttp session. Used as a context manager it lives for a single
+    block, shared clients (see getDefaultClient) keep their connection pool
+    open until close() is called.
+    """
+    # Connections in total and per host, seconds to cache DNS lookups and
+    # to keep idle connections around
+    LIMIT = 100
+    LIMIT_PER_HOST = 8
+    DNS_TTL = 300
+    KEEPALIVE = 60
+
+    def __init__(self, shared = False, limit = None, limitPerHost = None, dnsTtl = None, keepalive = None, scheduler = None):
         self._session = None
+        self.shared = shared
+        self.scheduler = scheduler
+        self.limit = limit or self.LIMIT
+        self.limitPerHost = limitPerHost or self.LIMIT_PER_HOST
+        self.dnsTtl = dnsTtl or self.DNS_TTL
+        self.keepalive = keepalive or self.KEEPALIVE
 
     async def __aenter__(self):
-        self._session = aiohttp.ClientSession()
+        self.open()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        await self._session.close()
+        if not self.shared:
+            await self.close()
+
+    @property
+    def closed(self):
+        return self._session == None or self._session.closed
+
+    def open(self):
+        if not self.closed:
+            return
+
+        # The connector stays the hard cap on sockets, the scheduler decides
+        # the order within it. Its per host limit has to fit, long polls
+        # bypass the scheduler and take up the connections above it.
+        limitPerHost = self.limitPerHost
+        if self.scheduler:
+            limitPerHost = max(limitPerHost, self.scheduler.perHost)
+        connector = aiohttp.TCPConnector(
+            limit = self.limit,
+            limit_per_host = limitPerHost,
+            ttl_dns_cache = self.dnsTtl,
+            keepalive_timeout = self.keepalive
+        )
+        self._session = aiohttp.ClientSession(connector = connector)
+
+    async def close(self):
+        if not self.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method, url, priority = None, capability = None, **kwargs):
+        self.open()
+        if not self.scheduler:
+            response = await self._session.request(method, url, **kwargs)
+            return HttpResponse(response)
+        
+        parts = urlsplit(url)
+        slot = await self.scheduler.acquire(parts.netloc, capability, priority)
+        try:
+            response = await self._session.request(method, url, **kwargs)
+        except BaseException:
+            self.scheduler.release(slot)
+            raise
+        return HttpResponse(response, self.scheduler, slot)
 
     async def get(self, url, **kwargs):
-        response = await self._session.get(url, **kwargs)
-        return HttpResponse(response)
+        return await self.request("GET", url, **kwargs)
 
     async def post(self, url, **kwargs):
-        response = await self._session.post(url, **kwargs)
-        return HttpResponse(response)
+        return await self.request("POST", url, **kwargs)
 
     async def put(self, url, **kwargs):
-        response = await self._session.put(url, **kwargs)
-        return HttpResponse(response)
+        return await self.request("PUT", url, **kwargs)
 
     async def delete(self, url, **kwargs):
-        response = await self._session.delete(url, **kwargs)
-        return HttpResponse(response)
+        return await self.request("DELETE", url, **kwargs)
 
     async def head(self, url, **kwargs):
-        response = await self._session.head(url, **kwargs)
-        return HttpResponse(response)
+        return await self.request("HEAD", url, **kwargs)
 
     async def options(self, url, **kwargs):
-        response = await self._session.options(url, **kwargs)
-        return HttpResponse(response)
+        return await self.request("OPTIONS", url, **kwargs)
 
     async def patch(self, url, **kwargs):
-        response = await self._session.patch(url, **kwargs)
-        return HttpResponse(response)
\ No newline at end of file
+        return await self.request("PATCH", url, **kwargs)
+
+
+# aiohttp sessions belong to the event loop they were made on
+__defaultClient = None
+__defaultLoop = None
+def getDefaultClient():
+    """The process wide shared client for the running event loop."""
+    global __defaultClient, __defaultLoop
+    loop = asyncio.get_running_loop()
+    if not __defaultClient or __defaultLoop != loop:
+        __defaultClient = HttpClient(shared = True, scheduler = RequestScheduler())
+        __defaultLoop = loop
+    return __defaultClient
+
+async def closeDefaultClient():
+    global __defaultClient, __defaultLoop
+    if __defaultClient:
+        await __defaultClient.close()
+    __defaultClient = None
+    __defaultLoop = None
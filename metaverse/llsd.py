@@ -25,7 +25,8 @@ freely, subject to the following restrictions:
 import uuid
 import datetime
 import base64
-import io
+import functools
+import re
 import struct
 import xml.etree.ElementTree as ET
 
@@ -33,6 +34,16 @@ class URI(str):
     def __repr__(self):
         return "URI({})".format(super().__repr__())
 
+BINARY_HEADER = b"<?llsd/binary?>\n"
+NOTATION_HEADER = b"<?llsd/notation?>\n"
+# Binary dates are seconds since the epoch, datetimes are naive UTC
+EPOCH = datetime.datetime(1970, 1, 1)
+
+sInt = struct.Struct(">i")
+sSize = struct.Struct(">I")
+sReal = struct.Struct(">d")
+sDate = struct.Struct("<d")
+
 #Encoders
 def llsdEncodeXml(input, destination, *args, optimize = False, encoding = "base64", **kwargs):
     t = type(input)
@@ -92,97 +103,927 @@ def llsdEncodeXml(input, destination, *args, optimize = False, encoding = "base6
         for value in input:
             llsdEncodeXml(value, root, *args, **kwargs)
 
+# Same output as building the tree above and writing it with ElementTree,
+# without the tree. Like there, optimize and encoding only apply to the
+# outermost value, whatever is inside maps and arrays uses the defaults.
+XML_HEADER = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+
+def _escapeXml(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+def _encodeXmlUndef(input, output, optimize, encoding):
+    output.append("<undef />")
+
+def _encodeXmlBool(input, output, optimize, encoding):
+    if input:
+        output.append("<boolean>true</boolean>")
+    elif optimize:
+        output.append("<boolean />")
+    else:
+        output.append("<boolean>false</boolean>")
+
+def _encodeXmlNumber(tag):
+    empty = "<{} />".format(tag)
+    start = "<{}>".format(tag)
+    end = "</{}>".format(tag)
+    def encoder(input, output, optimize, encoding):
+        if input != 0 or not optimize:
+            output.append(start + str(input) + end)
+        else:
+            output.append(empty)
+    return encoder
+
+def _encodeXmlUUID(input, output, optimize, encoding):
+    if input.bytes != b"\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0" or not optimize:
+        output.append("<uuid>" + str(input) + "</uuid>")
+    else:
+        output.append("<uuid />")
+
+def _encodeXmlString(tag):
+    empty = "<{} />".format(tag)
+    start = "<{}>".format(tag)
+    end = "</{}>".format(tag)
+    def encoder(input, output, optimize, encoding):
+        if input:
+            output.append(start + _escapeXml(input) + end)
+        else:
+            output.append(empty)
+    return encoder
+
+def _encodeXmlBinary(input, output, optimize, encoding):
+    if input == b"" and optimize:
+        output.append("<binary />")
+        return
+    
+    if encoding == "base64":
+        text = base64.b64encode(input).decode()
+    elif encoding == "base85":
+        text = _escapeXml(base64.b85encode(input).decode())
+    elif encoding == "base16":
+        text = base64.b16encode(input).decode()
+    else:
+        raise ValueError("Unknown binary encoding {}!".format(encoding))
+    output.append("<binary>" + text + "</binary>" if text else "<binary />")
+
+def _encodeXmlDate(input, output, optimize, encoding):
+    output.append(input.strftime("<date>%Y-%m-%dT%H:%M:%S.%fZ</date>"))
+
+def _encodeXmlMap(input, output, optimize, encoding):
+    if not input:
+        output.append("<map />")
+        return
+    
+    output.append("<map>")
+    for key, value in input.items():
+        if type(key) != str:
+            raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+        output.append("<key>" + _escapeXml(key) + "</key>" if key else "<key />")
+        encoder = _xmlEncoders.get(type(value))
+        if encoder:
+            encoder(value, output, False, "base64")
+    output.append("</map>")
+
+def _encodeXmlArray(input, output, optimize, encoding):
+    if not input:
+        output.append("<array />")
+        return
+    
+    output.append("<array>")
+    for value in input:
+        encoder = _xmlEncoders.get(type(value))
+        if encoder:
+            encoder(value, output, False, "base64")
+    output.append("</array>")
+
+_xmlEncoders = {
+    type(None): _encodeXmlUndef,
+    bool: _encodeXmlBool,
+    int: _encodeXmlNumber("integer"),
+    float: _encodeXmlNumber("real"),
+    uuid.UUID: _encodeXmlUUID,
+    str: _encodeXmlString("string"),
+    URI: _encodeXmlString("uri"),
+    bytes: _encodeXmlBinary,
+    datetime.datetime: _encodeXmlDate,
+    dict: _encodeXmlMap,
+    list: _encodeXmlArray
+}
+
+def llsdEncodeXmlFragments(input, output, optimize = False, encoding = "base64"):
+    """
+    Append the XML form of input to output, a list of strings. Types LLSD
+    has no name for are left out, same as llsdEncodeXml does.
+    """
+    encoder = _xmlEncoders.get(type(input))
+    if encoder:
+        encoder(input, output, optimize, encoding)
+
+def _joinXml(output):
+    return "".join(output).encode("utf-8", "xmlcharrefreplace")
+
+class XmlTemplate:
+    """
+    LLSD+XML document encoded once, with holes for the few values that change
+    between requests. Meant for payloads sent over and over, like event queue
+    polls that only differ in their ack.
+    """
+    class Field:
+        def __init__(self, name):
+            self.name = name
+    
+    def __init__(self, template, optimize = True, encoding = "base64"):
+        if type(template) not in (dict, list):
+            raise ValueError("Templates have to be a map or an array!")
+        
+        output = ["<llsd>"]
+        llsdEncodeXmlFragments(template, output, optimize, encoding)
+        output.append("</llsd>")
+        
+        # Fields are written as themselves, everything in between them is
+        # static and follows the field it comes after
+        self.head = XML_HEADER
+        self.fields = []
+        static = []
+        for fragment in output:
+            if type(fragment) == self.Field:
+                if self.fields:
+                    self.fields[-1][1] = "".join(static)
+                else:
+                    self.head += _joinXml(static)
+                self.fields.append([fragment.name, ""])
+                static = []
+            else:
+                static.append(fragment)
+        
+        if self.fields:
+            self.fields[-1][1] = "".join(static)
+        else:
+            self.head += _joinXml(static)
+        
+        # Unchanged values, like polls without news, reuse the last result
+        self.last = None
+        self.lastResult = None
+    
+    def encode(self, **values):
+        key = [(type(values[name]), values[name]) for name, _ in self.fields]
+        if key == self.last:
+            return self.lastResult
+        
+        output = []
+        for name, static in self.fields:
+            value = values[name]
+            encoder = _xmlEncoders.get(type(value))
+            if encoder:
+                encoder(value, output, False, "base64")
+            output.append(static)
+        
+        self.last = key
+        self.lastResult = self.head + _joinXml(output)
+        return self.lastResult
+
+_xmlEncoders[XmlTemplate.Field] = lambda input, output, optimize, encoding: output.append(input)
+
+def _encodeBinaryUndef(input, output):
+    output += b"!"
+
+def _encodeBinaryBool(input, output):
+    output += b"1" if input else b"0"
+
+def _encodeBinaryInt(input, output):
+    if not -0x80000000 <= input <= 0x7FFFFFFF:
+        raise ValueError("Integer {} does not fit in 32 bits for binary LLSD!".format(input))
+    output += b"i"
+    output += sInt.pack(input)
+
+def _encodeBinaryReal(input, output):
+    output += b"r"
+    output += sReal.pack(input)
+
+def _encodeBinaryUUID(input, output):
+    output += b"u"
+    output += input.bytes
+
+def _encodeBinarySized(marker):
+    def encoder(input, output):
+        if type(input) != bytes:
+            input = input.encode()
+        output += marker
+        output += sSize.pack(len(input))
+        output += input
+    return encoder
+
+def _encodeBinaryDate(input, output):
+    output += b"d"
+    output += sDate.pack((input - EPOCH).total_seconds())
+
+def _encodeBinaryMap(input, output):
+    output += b"{"
+    output += sSize.pack(len(input))
+    for key, value in input.items():
+        if type(key) != str:
+            raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+        key = key.encode()
+        output += b"k"
+        output += sSize.pack(len(key))
+        output += key
+        llsdEncodeBinary(value, output)
+    output += b"}"
+
+def _encodeBinaryArray(input, output):
+    output += b"["
+    output += sSize.pack(len(input))
+    for value in input:
+        llsdEncodeBinary(value, output)
+    output += b"]"
+
+_binaryEncoders = {
+    type(None): _encodeBinaryUndef,
+    bool: _encodeBinaryBool,
+    int: _encodeBinaryInt,
+    float: _encodeBinaryReal,
+    uuid.UUID: _encodeBinaryUUID,
+    str: _encodeBinarySized(b"s"),
+    URI: _encodeBinarySized(b"l"),
+    bytes: _encodeBinarySized(b"b"),
+    datetime.datetime: _encodeBinaryDate,
+    dict: _encodeBinaryMap,
+    list: _encodeBinaryArray
+}
+
+def llsdEncodeBinary(input, output):
+    """Append the binary form of input to the output bytearray."""
+    try:
+        encoder = _binaryEncoders[type(input)]
+    except KeyError:
+        raise ValueError("Unable to encode type {} as LLSD!".format(type(input)))
+    encoder(input, output)
+
+_notationEscapes = {i: "\\x{:02x}".format(i) for i in range(32)}
+_notationEscapes.update({
+    ord("\\"): "\\\\",
+    ord("'"): "\\'",
+    ord('"'): '\\"'
+})
+
+def _encodeNotationBinary(input, output, encoding):
+    if encoding == "base64":
+        output.append('b64"' + base64.b64encode(input).decode() + '"')
+    elif encoding == "base85":
+        output.append('b85"' + base64.b85encode(input).decode() + '"')
+    elif encoding == "base16":
+        output.append('b16"' + base64.b16encode(input).decode() + '"')
+    else:
+        raise ValueError("Unknown binary encoding {}!".format(encoding))
+
+def llsdEncodeNotation(input, output, encoding = "base64"):
+    """Append the notation form of input to output, a list of strings."""
+    t = type(input)
+    if input is None:
+        output.append("!")
+    elif t == bool:
+        output.append("true" if input else "false")
+    elif t == int:
+        output.append("i{}".format(input))
+    elif t == float:
+        output.append("r{!r}".format(input))
+    elif t == uuid.UUID:
+        output.append("u{}".format(input))
+    elif t == str:
+        output.append("'" + input.translate(_notationEscapes) + "'")
+    elif t == URI:
+        output.append('l"' + input.translate(_notationEscapes) + '"')
+    elif t == bytes:
+        _encodeNotationBinary(input, output, encoding)
+    elif t == datetime.datetime:
+        output.append(input.strftime('d"%Y-%m-%dT%H:%M:%S.%fZ"'))
+    elif t == dict:
+        output.append("{")
+        first = True
+        for key, value in input.items():
+            if type(key) != str:
+                raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+            if not first:
+                output.append(",")
+            first = False
+            output.append("'" + key.translate(_notationEscapes) + "':")
+            llsdEncodeNotation(value, output, encoding)
+        output.append("}")
+    elif t == list:
+        output.append("[")
+        for i, value in enumerate(input):
+            if i:
+                output.append(",")
+            llsdEncodeNotation(value, output, encoding)
+        output.append("]")
+    else:
+        raise ValueError("Unable to encode type {} as LLSD!".format(t))
+
 def llsdEncode(input, *args, format = "xml", **kwargs):
-    if format == "xml":
-        root = ET.Element("llsd")
-        if "optimize" not in kwargs:
-            kwargs["optimize"] = True
-        llsdEncodeXml(input, root, *args, **kwargs)
-        xml = ET.ElementTree(root)
-        f = io.BytesIO()
-        xml.write(f, encoding='UTF-8', xml_declaration=True)
-        return f.getvalue()
+    if format == "notation":
+        output = []
+        llsdEncodeNotation(input, output, kwargs.get("encoding", "base64"))
+        result = "".join(output).encode()
+        if kwargs.get("header", True):
+            result = NOTATION_HEADER + result
+        return result
+    
+    elif format == "binary":
+        output = bytearray(BINARY_HEADER if kwargs.get("header", True) else b"")
+        llsdEncodeBinary(input, output)
+        return bytes(output)
+    
+    elif format == "xml":
+        output = []
+        llsdEncodeXmlFragments(input, output, kwargs.get("optimize", True), kwargs.get("encoding", "base64"))
+        if not output:
+            return XML_HEADER + b"<llsd />"
+        return XML_HEADER + b"<llsd>" + _joinXml(output) + b"</llsd>"
 
 #Decoders
+_isoDate = re.compile(r"(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+)(?:\.(\d+))?Z?$")
+
+# The same few timestamps tend to show up over and over
+@functools.lru_cache(maxsize = 1024)
 def parseISODate(input):
+    match = _isoDate.match(input)
+    if not match:
+        raise ValueError("Invalid timestamp '{}'!".format(input))
+    
+    year, month, day, hour, minute, second, fraction = match.groups()
+    # Fractions are of a second, ".5" is half a second
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction else 0
     try:
-        if input[-1] == "Z":
-            input = input[:-1]
-        date, time = input.split("T", 2)
-        year, month, day = date.split("-", 3)
-        hour, minute, second = time.split(":", 3)
-        if "." in second:
-            second, microsecond = second.split(".", 2)
-        else:
-            microsecond = 0
-        return datetime.datetime(*[int(i) for i in [year, month, day, hour, minute, second, microsecond]])
+        return datetime.datetime(int(year), int(month), int(day),
+                                 int(hour), int(minute), int(second), microsecond)
     except ValueError:
         raise ValueError("Invalid timestamp '{}'!".format(input))
 
-def llsdDecodeXml(input):
-    if input.tag == "undef":
-        return None
-    elif input.tag == "boolean":
-        value = input.text
-        if value == None:
-            return False
-        value = value.lower()
-        if value in ["1", "true"]:
-            return True
-        elif value in ["", "0", "false"]:
-            return False
-        else:
-            raise ValueError("Unexpected value '{}' for boolean!".format(value))
-    elif input.tag == "integer":
-        if input.text == None:
-            return 0
-        return int(input.text)
-    elif input.tag == "real":
-        if input.text == None:
-            return 0
-        return float(input.text)
-    elif input.tag == "uuid":
-        if input.text == None:
-            return uuid.UUID(bytes=b"\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0")
-        return uuid.UUID(input.text)
-    elif input.tag == "string":
-        if input.text == None:
-            return ""
-        return input.text
-    elif input.tag == "binary":
-        if input.text == None:
-            return b""
-        encoding = input.attrib.get("encoding", "base64").lower()
-        if encoding == "base64":
-            return base64.b64decode(input.text)
-        elif encoding == "base85":
-            return base64.b85decode(input.text)
-        elif encoding == "base16":
-            return base64.b16decode(input.text)
-        else:
-            raise ValueError("Unknown encoding {} for binary element!".format(encoding))
-    elif input.tag == "date":
-        if input.text == None:
-            return datetime.datetime.fromtimestamp(0)
-        return parseISODate(input.text)
-    elif input.tag == "uri":
-        if input.text == None:
-            return URI("")
-        return URI(input.text)
-    elif input.tag == "map":
-        result = {}
-        for i in range(0, len(input), 2):
-            if input[i].tag != "key":
-                raise ValueError("Unexpected {} element in map, expected key!".format(input[i].tag))
-            result[input[i].text] = llsdDecodeXml(input[i+1])
-        return result
-    elif input.tag == "array":
-        result = [None]*len(input)
-        for i in range(0, len(input)):
-            result[i] = llsdDecodeXml(input[i])
-        return result
+ZERO_UUID = uuid.UUID(bytes=b"\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0")
+
+def _uuidBytes(text):
+    try:
+        result = bytes.fromhex(text.replace("-", ""))
+        if len(result) == 16:
+            return result
+    except ValueError:
+        pass
+    # Let UUID sort out the odd forms, or complain about them
+    return uuid.UUID(text).bytes
+
+class XmlInterner:
+    """
+    Hands out the same object for map keys and UUIDs that were seen before,
+    they repeat a lot between documents like event queue payloads. Forgets
+    everything of a kind once it holds limit entries.
+    """
+    LIMIT = 10000
+    
+    def __init__(self, limit = None):
+        self.limit = limit or self.LIMIT
+        self.keys = {}
+        self.uuids = {}
+        self.rawUuids = {}
+    
+    def key(self, text):
+        try:
+            return self.keys[text]
+        except KeyError:
+            if len(self.keys) >= self.limit:
+                self.keys.clear()
+            self.keys[text] = text
+            return text
+    
+    def uuid(self, text, raw = False):
+        cache = self.rawUuids if raw else self.uuids
+        try:
+            return cache[text]
+        except KeyError:
+            if len(cache) >= self.limit:
+                cache.clear()
+            value = _uuidBytes(text) if raw else uuid.UUID(text)
+            cache[text] = value
+            return value
+
+def _decodeXmlUndef(input, interner, raw):
+    return None
+
+def _decodeXmlBool(input, interner, raw):
+    value = input.text
+    if value == None:
+        return False
+    value = value.lower()
+    if value in ["1", "true"]:
+        return True
+    elif value in ["", "0", "false"]:
+        return False
+    else:
+        raise ValueError("Unexpected value '{}' for boolean!".format(value))
+
+def _decodeXmlInt(input, interner, raw):
+    if input.text == None:
+        return 0
+    return int(input.text)
+
+def _decodeXmlReal(input, interner, raw):
+    if input.text == None:
+        return 0
+    return float(input.text)
+
+def _decodeXmlUUID(input, interner, raw):
+    text = input.text
+    if text == None:
+        return ZERO_UUID.bytes if raw else ZERO_UUID
+    if interner != None:
+        return interner.uuid(text, raw)
+    if raw:
+        return _uuidBytes(text)
+    return uuid.UUID(text)
+
+def _decodeXmlString(input, interner, raw):
+    if input.text == None:
+        return ""
+    return input.text
+
+def _decodeXmlBinary(input, interner, raw):
+    if input.text == None:
+        return b""
+    encoding = input.attrib.get("encoding", "base64").lower()
+    if encoding == "base64":
+        return base64.b64decode(input.text)
+    elif encoding == "base85":
+        return base64.b85decode(input.text)
+    elif encoding == "base16":
+        return base64.b16decode(input.text)
     else:
+        raise ValueError("Unknown encoding {} for binary element!".format(encoding))
+
+def _decodeXmlDate(input, interner, raw):
+    if input.text == None:
+        return datetime.datetime.fromtimestamp(0)
+    return parseISODate(input.text)
+
+def _decodeXmlURI(input, interner, raw):
+    if input.text == None:
+        return URI("")
+    return URI(input.text)
+
+def _decodeXmlMap(input, interner, raw):
+    result = {}
+    elements = iter(input)
+    for key in elements:
+        if key.tag != "key":
+            raise ValueError("Unexpected {} element in map, expected key!".format(key.tag))
+        text = key.text or ""
+        if interner != None:
+            text = interner.key(text)
+        
+        value = next(elements, None)
+        if value == None:
+            raise ValueError("Missing value for key {} in map!".format(text))
+        try:
+            decoder = _xmlDecoders[value.tag]
+        except KeyError:
+            raise ValueError("Unexpected {} element in LLSD!".format(value.tag))
+        result[text] = decoder(value, interner, raw)
+    return result
+
+def _decodeXmlArray(input, interner, raw):
+    result = []
+    for value in input:
+        try:
+            decoder = _xmlDecoders[value.tag]
+        except KeyError:
+            raise ValueError("Unexpected {} element in LLSD!".format(value.tag))
+        result.append(decoder(value, interner, raw))
+    return result
+
+_xmlDecoders = {
+    "undef": _decodeXmlUndef,
+    "boolean": _decodeXmlBool,
+    "integer": _decodeXmlInt,
+    "real": _decodeXmlReal,
+    "uuid": _decodeXmlUUID,
+    "string": _decodeXmlString,
+    "binary": _decodeXmlBinary,
+    "date": _decodeXmlDate,
+    "uri": _decodeXmlURI,
+    "map": _decodeXmlMap,
+    "array": _decodeXmlArray
+}
+
+def llsdDecodeXml(input, interner = None, raw = False):
+    """
+    Decode an LLSD element. Map keys and UUIDs are shared through interner
+    if one is given, raw returns UUIDs as 16 bytes instead of uuid.UUID.
+    """
+    try:
+        decoder = _xmlDecoders[input.tag]
+    except KeyError:
         raise ValueError("Unexpected {} element in LLSD!".format(input.tag))
+    return decoder(input, interner, raw)
+
+class XmlDecoder:
+    """
+    Incremental LLSD+XML decoder. Values are built as their elements close,
+    and finished elements are dropped right away so the whole element tree
+    never exists at once. With items set, the values of a top level array
+    are returned by feed() and close() as they complete instead of being
+    collected into it.
+    """
+    def __init__(self, items = False, interner = None, raw = False):
+        self.parser = ET.XMLPullParser(events = ("start", "end"))
+        self.items = items
+        self.interner = interner
+        self.raw = raw
+        self.elements = []
+        # Open containers as [container, is map, pending key]
+        self.stack = []
+        self.value = None
+        self.done = False
+    
+    def feed(self, data):
+        self.parser.feed(data)
+        return self.process()
+    
+    def close(self):
+        self.parser.close()
+        items = self.process()
+        if not self.done:
+            raise ValueError("Truncated LLSD+XML!")
+        return items
+    
+    def process(self):
+        items = []
+        elements = self.elements
+        stack = self.stack
+        for event, elem in self.parser.read_events():
+            tag = elem.tag
+            if event == "start":
+                if not elements and tag != "llsd":
+                    raise ValueError("Unexpected tag {} in LLSD+XML!".format(tag))
+                elements.append(elem)
+                if tag == "map":
+                    stack.append([{}, True, None])
+                elif tag == "array":
+                    stack.append([[], False, None])
+                continue
+            
+            elements.pop()
+            if not elements:
+                self.done = True
+                elem.clear()
+                continue
+            
+            # Everything before this element in its parent is done with
+            del elements[-1][:]
+            
+            if tag == "key":
+                if not stack or not stack[-1][1] or stack[-1][2] != None:
+                    raise ValueError("Unexpected key element outside of map!")
+                key = elem.text or ""
+                if self.interner != None:
+                    key = self.interner.key(key)
+                stack[-1][2] = key
+                continue
+            
+            elif tag == "map" or tag == "array":
+                if stack[-1][2] != None:
+                    raise ValueError("Missing value for key {} in map!".format(stack[-1][2]))
+                value = stack.pop()[0]
+            
+            else:
+                value = llsdDecodeXml(elem, self.interner, self.raw)
+            
+            if not stack:
+                self.value = value
+                continue
+            
+            top = stack[-1]
+            if top[1]:
+                if top[2] == None:
+                    raise ValueError("Unexpected {} element in map, expected key!".format(tag))
+                top[0][top[2]] = value
+                top[2] = None
+            elif self.items and len(stack) == 1:
+                items.append(value)
+            else:
+                top[0].append(value)
+        
+        return items
+
+def llsdDecodeXmlStream(chunks, interner = None, raw = False):
+    """Decode LLSD+XML from an iterable of chunks."""
+    decoder = XmlDecoder(interner = interner, raw = raw)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    decoder.close()
+    return decoder.value
+
+def llsdIterXmlItems(chunks, interner = None, raw = False):
+    """Yield the values of a top level LLSD+XML array as they are decoded."""
+    decoder = XmlDecoder(items = True, interner = interner, raw = raw)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+def _decodeBinaryUndef(view, offset):
+    return None, offset
+
+def _decodeBinaryTrue(view, offset):
+    return True, offset
+
+def _decodeBinaryFalse(view, offset):
+    return False, offset
+
+def _decodeBinaryInt(view, offset):
+    return sInt.unpack_from(view, offset)[0], offset + 4
+
+def _decodeBinaryReal(view, offset):
+    return sReal.unpack_from(view, offset)[0], offset + 8
+
+def _decodeBinaryUUID(view, offset):
+    end = offset + 16
+    if end > len(view):
+        raise ValueError("Truncated uuid in LLSD+binary!")
+    return uuid.UUID(bytes=bytes(view[offset:end])), end
+
+def _decodeBinaryString(view, offset):
+    end = offset + 4 + sSize.unpack_from(view, offset)[0]
+    if end > len(view):
+        raise ValueError("Truncated string in LLSD+binary!")
+    return str(view[offset + 4:end], "utf-8"), end
+
+def _decodeBinaryURI(view, offset):
+    value, offset = _decodeBinaryString(view, offset)
+    return URI(value), offset
+
+def _decodeBinaryBytes(view, offset):
+    end = offset + 4 + sSize.unpack_from(view, offset)[0]
+    if end > len(view):
+        raise ValueError("Truncated binary in LLSD+binary!")
+    return bytes(view[offset + 4:end]), end
+
+def _decodeBinaryDate(view, offset):
+    return EPOCH + datetime.timedelta(seconds=sDate.unpack_from(view, offset)[0]), offset + 8
+
+_binaryDecoders = {
+    ord("!"): _decodeBinaryUndef,
+    ord("1"): _decodeBinaryTrue,
+    ord("0"): _decodeBinaryFalse,
+    ord("i"): _decodeBinaryInt,
+    ord("r"): _decodeBinaryReal,
+    ord("u"): _decodeBinaryUUID,
+    ord("s"): _decodeBinaryString,
+    ord("l"): _decodeBinaryURI,
+    ord("b"): _decodeBinaryBytes,
+    ord("d"): _decodeBinaryDate
+}
+
+def llsdDecodeBinary(input, offset = 0):
+    """
+    Decode binary LLSD without its header. Containers are tracked on a stack
+    instead of recursing, values are read straight out of a memoryview.
+    """
+    view = memoryview(input)
+    decoders = _binaryDecoders
+    # Open containers as [container, items left, closing marker, pending key]
+    stack = []
+    try:
+        while True:
+            top = stack[-1] if stack else None
+            if top and top[2] == 0x7D: # }
+                if view[offset] != 0x6B: # k
+                    raise ValueError("Expected key in LLSD+binary map at offset {}!".format(offset))
+                top[3], offset = _decodeBinaryString(view, offset + 1)
+            
+            marker = view[offset]
+            offset += 1
+            decoder = decoders.get(marker)
+            if decoder:
+                value, offset = decoder(view, offset)
+            
+            elif marker == 0x7B or marker == 0x5B: # { [
+                count = sSize.unpack_from(view, offset)[0]
+                offset += 4
+                if count:
+                    stack.append([{} if marker == 0x7B else [], count, marker + 2, None])
+                    continue
+                
+                if view[offset] != marker + 2:
+                    raise ValueError("Unterminated container in LLSD+binary at offset {}!".format(offset))
+                offset += 1
+                value = {} if marker == 0x7B else []
+            
+            else:
+                raise ValueError("Unexpected marker {!r} in LLSD+binary at offset {}!".format(chr(marker), offset - 1))
+            
+            # Hand the value to its container, closing every container it completes
+            while True:
+                if not stack:
+                    return value
+                
+                top = stack[-1]
+                if top[2] == 0x7D:
+                    top[0][top[3]] = value
+                else:
+                    top[0].append(value)
+                
+                top[1] -= 1
+                if top[1]:
+                    break
+                
+                if view[offset] != top[2]:
+                    raise ValueError("Unterminated container in LLSD+binary at offset {}!".format(offset))
+                offset += 1
+                value = stack.pop()[0]
+    
+    except (IndexError, struct.error):
+        raise ValueError("Truncated LLSD+binary!")
+
+_notationToken = re.compile(rb"""
+    [\s,:]*
+    (?:
+        (?P<open>[{\[])
+      | (?P<close>[}\]])
+      | (?P<undef>!)
+      | i(?P<int>[-+]?[0-9]+)
+      | r(?P<real>[-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|[-+]?nan|[-+]?inf)
+      | u(?P<uuid>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})
+      | (?P<sized>[sb])\((?P<size>[0-9]+)\)(?P<sizedQuote>["'])
+      | (?P<prefix>b64|b85|b16|[dlsb])?(?:"(?P<dq>(?:[^"\\]|\\.)*)"|'(?P<sq>(?:[^'\\]|\\.)*)')
+      | (?P<bool>true|false|TRUE|FALSE|[01tfTF])
+    )
+""", re.X | re.S)
+_notationSpace = re.compile(rb"[\s,:]*")
+_notationEscape = re.compile(rb"\\(x[0-9a-fA-F]{2}|.)", re.S)
+_notationUnescapes = {
+    b"a": b"\a", b"b": b"\b", b"f": b"\f", b"n": b"\n",
+    b"r": b"\r", b"t": b"\t", b"v": b"\v"
+}
+
+def _unescapeNotation(match):
+    value = match.group(1)
+    if len(value) == 3:
+        return bytes((int(value[1:], 16),))
+    return _notationUnescapes.get(value, value)
+
+def _decodeNotationQuoted(prefix, raw):
+    if b"\\" in raw:
+        raw = _notationEscape.sub(_unescapeNotation, raw)
+    
+    if prefix == None or prefix == b"s":
+        return raw.decode()
+    elif prefix == b"l":
+        return URI(raw.decode())
+    elif prefix == b"d":
+        return parseISODate(raw.decode())
+    elif prefix == b"b64" or prefix == b"b":
+        return base64.b64decode(raw)
+    elif prefix == b"b85":
+        return base64.b85decode(raw)
+    elif prefix == b"b16":
+        return base64.b16decode(raw)
+
+class NotationDecoder:
+    """
+    Incremental LLSD notation parser. Feed it chunks as they arrive, each
+    call returns the top level values completed so far. A partial token at
+    the end of a chunk is picked up again once the rest of it is fed.
+    """
+    # Longest unquoted token that could still continue, "FALSE"
+    LOOKAHEAD = 5
+    
+    def __init__(self):
+        self.buffer = bytearray()
+        # Position of the start of the buffer in the stream, for errors
+        self.offset = 0
+        # Open containers as [container, is map, pending key]
+        self.stack = []
+        # Whether an optional NOTATION_HEADER may still be coming
+        self.header = True
+    
+    def skipHeader(self, final):
+        """Drop a leading header, returns False while it can't tell yet."""
+        buf = self.buffer
+        head = NOTATION_HEADER[:-1]
+        start = _notationSpace.match(buf).end()
+        seen = bytes(buf[start:start + len(head)])
+        if seen == head:
+            del buf[:start + len(head)]
+            self.offset += start + len(head)
+        elif head.startswith(seen) and not final:
+            return False
+        
+        self.header = False
+        return True
+    
+    def feed(self, data = b"", final = False):
+        buf = self.buffer
+        buf += data
+        if self.header and not self.skipHeader(final):
+            return []
+        
+        stack = self.stack
+        values = []
+        pos = 0
+        size = len(buf)
+        
+        while True:
+            match = _notationToken.match(buf, pos)
+            if not match:
+                if _notationSpace.match(buf, pos).end() == size:
+                    pos = size
+                    break
+                if not final:
+                    break
+                raise ValueError("Unexpected {!r} in LLSD+notation at offset {}!".format(bytes(buf[pos:pos + 16]), self.offset + pos))
+            
+            end = match.end()
+            kind = match.lastgroup
+            
+            # Unquoted tokens might go on in the next chunk
+            if not final and end + self.LOOKAHEAD > size and kind in ("int", "real", "bool"):
+                break
+            
+            if kind == "sq" or kind == "dq":
+                value = _decodeNotationQuoted(match["prefix"], bytes(match[kind]))
+            
+            elif kind == "open":
+                stack.append([{}, True, None] if match["open"] == b"{" else [[], False, None])
+                pos = end
+                continue
+            
+            elif kind == "close":
+                if not stack or stack[-1][1] != (match["close"] == b"}") or stack[-1][2] != None:
+                    raise ValueError("Unexpected {!r} in LLSD+notation at offset {}!".format(match["close"].decode(), self.offset + end - 1))
+                value = stack.pop()[0]
+            
+            elif kind == "int":
+                value = int(match["int"])
+            
+            elif kind == "real":
+                value = float(match["real"])
+            
+            elif kind == "uuid":
+                value = uuid.UUID(match["uuid"].decode())
+            
+            elif kind == "bool":
+                value = match["bool"] in (b"1", b"t", b"T", b"true", b"TRUE")
+            
+            elif kind == "undef":
+                value = None
+            
+            else:
+                start = end
+                end = start + int(match["size"])
+                if end >= size:
+                    if final:
+                        raise ValueError("Truncated LLSD+notation!")
+                    break
+                if buf[end] != match["sizedQuote"][0]:
+                    raise ValueError("Sized value in LLSD+notation at offset {} has the wrong length!".format(self.offset + start))
+                raw = bytes(buf[start:end])
+                end += 1
+                value = raw.decode() if match["sized"] == b"s" else raw
+            
+            pos = end
+            if not stack:
+                values.append(value)
+                continue
+            
+            top = stack[-1]
+            if not top[1]:
+                top[0].append(value)
+            elif top[2] == None:
+                if type(value) != str:
+                    raise ValueError("Expected key in LLSD+notation map at offset {}!".format(self.offset + match.start()))
+                top[2] = value
+            else:
+                top[0][top[2]] = value
+                top[2] = None
+        
+        if final and stack:
+            raise ValueError("Truncated LLSD+notation!")
+        
+        # Drop what has been parsed
+        del buf[:pos]
+        self.offset += pos
+        return values
+    
+    def close(self):
+        return self.feed(final = True)
+
+def llsdDecodeNotation(input):
+    values = NotationDecoder().feed(input, final = True)
+    if len(values) != 1:
+        raise ValueError("Expected a single value in LLSD+notation, got {}!".format(len(values)))
+    return values[0]
 
 def llsdDecode(input, *args, format = None, maxHeaderLength = 128, **kwargs):
     if format == None:
@@ -213,24 +1054,37 @@ def llsdDecode(input, *args, format = None, maxHeaderLength = 128, **kwargs):
             if c == ">":
                 break
         header = input[2:i-2].strip().lower()
+        if type(header) != str:
+            header = bytes(header).decode(errors = "replace")
         if header == "llsd/notation":
             format = "notation"
         elif header == "llsd/binary":
             format = "binary"
         else:
-            tmp = header[0:3]
-            if type(tmp) == bytes:
-                tmp = tmp.decode()
-            if tmp == "xml":
+            if header[0:3] == "xml":
                 format = "xml"
             else:
                 raise ValueError("Unable to detect serialization format!")
     
-    if format == "xml":
+    if format == "notation":
+        if type(input) == str:
+            input = input.encode()
+        return llsdDecodeNotation(input)
+    
+    elif format == "binary":
+        view = memoryview(input)
+        offset = 0
+        if view[:len(BINARY_HEADER) - 1] == BINARY_HEADER[:-1]:
+            offset = len(BINARY_HEADER) - 1
+            if offset < len(view) and view[offset] == 0x0A:
+                offset += 1
+        return llsdDecodeBinary(view, offset)
+    
+    elif format == "xml":
         input = ET.fromstring(input)
         if input.tag != "llsd":
             raise ValueError("Unexpected tag {} in LLSD+XML!".format(input.tag))
-        return llsdDecodeXml(input[0])
+        return llsdDecodeXml(input[0], kwargs.get("interner"), kwargs.get("raw", False))
     else:
         raise ValueError("Unknown serialization format {}!".format(format))
         
@@ -377,4 +1231,14 @@ if __name__ == "__main__":
   [
     l"http://sim956.agni.lindenlab.com:12035/runtime/agents"
   ]
-}"""
\ No newline at end of file
+}"""
+    
+    # Streaming has to cope with the default header, even split up
+    encoded = llsdEncode(source_test, format="notation")
+    decoder = NotationDecoder()
+    values = []
+    for i in range(len(encoded)):
+        values += decoder.feed(encoded[i:i + 1])
+    values += decoder.close()
+    assert values == [source_test]
+    assert llsdDecode(encoded) == source_test
@@ -96,7 +96,8 @@ async def Login(username, password,
           options = None,
           grid = "https://login.agni.lindenlab.com/cgi-bin/login.cgi",
           isBot = True,
-          token = ""
+          token = "",
+          client = None
     ):
     
     # Try our hardest to parse whatever we've been previded
@@ -183,12 +184,22 @@ async def Login(username, password,
         "mfa_hash": ""
     })
     
-    async with httpclient.HttpClient() as session:
-        async with await session.post(grid, data = requestBody, headers = {
-            "Content-Type": "application/llsd+xml"
-        }) as response:
-            resp = await response.read()
+    session = client or httpclient.getDefaultClient()
+    async with await session.post(grid, data = requestBody, headers = {
+        "Content-Type": "application/llsd+xml"
+    }) as response:
+        # Full logins are big, decode them as they come in. The inventory
+        # skeleton repeats the same keys and UUIDs a lot.
+        decoder = llsd.XmlDecoder(interner = llsd.XmlInterner())
+        if logger.isEnabledFor(logging.DEBUG):
             # Log the pre-parsed result, just in case the server returns something funky
+            resp = await response.read()
             logger.debug(f"Received login reply: {resp}")
-            return llsd.llsdDecode(resp, format="xml")
+            decoder.feed(resp)
+        else:
+            async for chunk in response.iterChunks():
+                decoder.feed(chunk)
+        
+        decoder.close()
+        return decoder.value
         
\ No newline at end of file
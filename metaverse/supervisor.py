@@ -0,0 +1,282 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+import time
+from .eventtarget import EventTarget
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Runs bots in several worker processes. Each worker gets a shard of the bot
+# configurations and runs target(context) in its own event loop. Workers
+# report health back every so often, crashed workers are restarted and if
+# one keeps crashing its bots are moved to the others.
+
+def loadCallable(path):
+    """Load a function or object from a string like 'package.module:func'."""
+    if ":" not in path:
+        raise ValueError(f"Invalid path '{path}', expected format 'module.submodule:function'")
+
+    modulePath, name = path.split(":", 1)
+    module = importlib.import_module(modulePath)
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise ImportError(f"Function '{name}' not found in module '{modulePath}'")
+
+
+class WorkerContext(EventTarget):
+    """
+    Handed to the target inside a worker process. Fires "Add" with a list of
+    configurations when bots are moved to this worker.
+    """
+    POLL = 0.1
+
+    def __init__(self, index, configs, conn, port = None):
+        super().__init__()
+        self.index = index
+        self.configs = configs
+        self.conn = conn
+        self.port = port
+        # Returns the health report, {"bots": {key: {..., "metrics": {...}}},
+        # "metrics": {...}} with the metrics of each bot and of the process
+        self.reporter = None
+        self.running = True
+
+    def report(self):
+        try:
+            data = self.reporter() if self.reporter else {}
+        except Exception:
+            logger.exception("Health reporter failed")
+            data = {}
+
+        self.conn.send(("health", data))
+
+    async def handleCommand(self, command):
+        if command[0] == "add":
+            self.configs.extend(command[1])
+            await self.fire("Add", command[1])
+
+        elif command[0] == "stop":
+            self.running = False
+
+    async def run(self, target, interval):
+        task = asyncio.create_task(target(self))
+        lastReport = 0
+        try:
+            while self.running and not task.done():
+                while self.conn.poll():
+                    await self.handleCommand(self.conn.recv())
+
+                now = time.monotonic()
+                if now - lastReport >= interval:
+                    self.report()
+                    lastReport = now
+
+                await asyncio.sleep(self.POLL)
+
+        except (EOFError, BrokenPipeError):
+            # The supervisor is gone, so are we
+            pass
+
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+def runWorker(target, index, configs, conn, port = None, interval = 5.0):
+    """Entry point of a worker process."""
+    if isinstance(target, str):
+        target = loadCallable(target)
+
+    context = WorkerContext(index, configs, conn, port)
+    try:
+        asyncio.run(context.run(target, interval))
+    except KeyboardInterrupt:
+        pass
+
+
+class Worker:
+    def __init__(self, index, configs, port = None):
+        self.index = index
+        self.configs = configs
+        self.port = port
+        self.process = None
+        self.conn = None
+        self.health = {}
+        self.lastReport = None
+        self.crashes = []
+        self.restartAt = None
+        self.retired = False
+
+    @property
+    def alive(self):
+        return self.process != None and self.process.is_alive()
+
+    def send(self, *command):
+        try:
+            self.conn.send(command)
+        except (OSError, BrokenPipeError):
+            pass
+
+
+class Supervisor(EventTarget):
+    """
+    Fires "Health" with a worker after each report and "Exit" with a worker
+    and exit code when a worker process ends unexpectedly.
+    """
+    POLL = 0.1
+
+    def __init__(self, target, configs, workers = None, basePort = None,
+                 healthInterval = 5.0, restartDelay = 1.0, maxRestarts = 5, restartWindow = 60.0):
+        super().__init__()
+        # Spawned workers import target by name, so it has to be a module
+        # level function or a 'module:func' string
+        self.target = target
+        self.healthInterval = healthInterval
+        self.restartDelay = restartDelay
+        self.maxRestarts = maxRestarts
+        self.restartWindow = restartWindow
+        self.context = multiprocessing.get_context("spawn")
+        self.running = False
+
+        count = max(1, min(workers or os.cpu_count() or 1, len(configs) or 1))
+        self.workers = []
+        for index in range(count):
+            port = basePort + 1 + index if basePort else None
+            self.workers.append(Worker(index, list(configs[index::count]), port))
+
+    def spawn(self, worker):
+        parentConn, childConn = self.context.Pipe()
+        worker.conn = parentConn
+        worker.health = {}
+        worker.lastReport = None
+        worker.restartAt = None
+        worker.process = self.context.Process(
+            target=runWorker,
+            args=(self.target, worker.index, worker.configs, childConn, worker.port, self.healthInterval),
+            name=f"metaverse-worker-{worker.index}",
+            daemon=True
+        )
+        worker.process.start()
+        childConn.close()
+        logger.info(f"Started worker {worker.index} (pid {worker.process.pid}) with {len(worker.configs)} bots")
+
+    async def run(self):
+        self.running = True
+        for worker in self.workers:
+            self.spawn(worker)
+
+        try:
+            while self.running:
+                now = time.monotonic()
+                for worker in self.workers:
+                    if worker.retired:
+                        continue
+
+                    if worker.restartAt != None:
+                        if now >= worker.restartAt:
+                            self.spawn(worker)
+                        continue
+
+                    await self.poll(worker)
+                    if not worker.alive:
+                        await self.handleExit(worker, now)
+
+                await asyncio.sleep(self.POLL)
+
+        finally:
+            await self.stop()
+
+    async def poll(self, worker):
+        try:
+            while worker.conn.poll():
+                message = worker.conn.recv()
+                if message[0] == "health":
+                    worker.health = message[1]
+                    worker.lastReport = time.time()
+                    await self.fire("Health", worker)
+        except (EOFError, OSError):
+            pass
+
+    async def handleExit(self, worker, now):
+        code = worker.process.exitcode
+        worker.conn.close()
+        logger.warning(f"Worker {worker.index} exited with code {code}")
+        await self.fire("Exit", worker, code)
+
+        worker.crashes = [t for t in worker.crashes if now - t < self.restartWindow] + [now]
+        if len(worker.crashes) > self.maxRestarts:
+            self.retire(worker)
+        else:
+            worker.restartAt = now + self.restartDelay
+
+    def retire(self, worker):
+        """Give up on a worker and move its bots to the ones still running."""
+        worker.retired = True
+        worker.health = {}
+        survivors = [w for w in self.workers if not w.retired]
+        if not survivors:
+            logger.error(f"Worker {worker.index} keeps crashing and no workers are left")
+            return
+
+        logger.error(f"Worker {worker.index} keeps crashing, moving its {len(worker.configs)} bots")
+        configs = worker.configs
+        worker.configs = []
+        for i, survivor in enumerate(survivors):
+            part = configs[i::len(survivors)]
+            if part:
+                survivor.configs.extend(part)
+                if survivor.alive:
+                    survivor.send("add", part)
+
+    def findWorker(self, key):
+        """Worker running the bot reported under key, or with key as an alias."""
+        key = str(key).lower()
+        for worker in self.workers:
+            for name, info in worker.health.get("bots", {}).items():
+                if name.lower() == key or key in info.get("aliases", ()):
+                    return worker
+        return None
+
+    def getHealth(self):
+        result = {}
+        for worker in self.workers:
+            result[worker.index] = {
+                "pid": worker.process.pid if worker.process else None,
+                "alive": worker.alive,
+                "retired": worker.retired,
+                "restarts": len(worker.crashes),
+                "configs": len(worker.configs),
+                "lastReport": worker.lastReport,
+                "bots": worker.health.get("bots", {})
+            }
+        return result
+
+    def getMetrics(self):
+        """Per worker, the metrics of the worker process and of each of its bots."""
+        result = {}
+        for worker in self.workers:
+            result[worker.index] = {
+                "worker": worker.health.get("metrics", {}),
+                "bots": {name: info.get("metrics", {}) for name, info in worker.health.get("bots", {}).items()}
+            }
+        return result
+
+    async def stop(self, timeout = 5.0):
+        self.running = False
+        for worker in self.workers:
+            if worker.alive:
+                worker.send("stop")
+
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            while worker.alive and time.monotonic() < deadline:
+                await asyncio.sleep(self.POLL)
+
+            if worker.alive:
+                worker.process.terminate()
@@ -2,4 +2,6 @@ from .agent import Agent
 from .circuit import Circuit
 from .messages import getDefaultTemplate
 from .packet import Packet
-from .simulator import Simulator
\ No newline at end of file
+from .simulator import Simulator
+from .throttle import Throttle
+from .transport import SocketPool, getDefaultPool
\ No newline at end of file
@@ -3,6 +3,7 @@ import struct
 
 from ..eventtarget import EventTarget
 from .simulator import Simulator
+from .throttle import Throttle
 from . import messages
 
 import logging
@@ -12,6 +13,13 @@ sHandle = struct.Struct("<II")
 sIP = struct.Struct("<BBBB")
 
 class Agent(EventTarget):
+    # Messages handled by handleMessage itself
+    SYSTEM_MESSAGES = frozenset((
+        "DisableSimulator",
+        "LogoutReply",
+        "KickUser"
+    ))
+    
     def __init__(self):
         super().__init__()
         self.username = (None, None)
@@ -22,6 +30,17 @@ class Agent(EventTarget):
         self.simulator = None
         self.simulators = []
         self.messageTemplate = messages.getDefaultTemplate()
+        # Decode message parameters on first access instead of on receipt
+        self.lazyMessages = False
+        # Bits per second per AgentThrottle category, used for pacing our
+        # own packets as well as announced to the simulator
+        self.throttles = Throttle.DEFAULTS
+        self.throttleCounter = 0
+        # Share UDP sockets with other agents instead of one per circuit,
+        # see transport.getDefaultPool()
+        self.socketPool = None
+        # HttpClient for capabilities, None uses httpclient.getDefaultClient()
+        self.http = None
     
     async def addSimulator(self, handle, host, circuit, caps = None, parent = False):
         logger.debug(f"Connecting to {host} with circuit {circuit}")
@@ -36,7 +55,7 @@ class Agent(EventTarget):
             logger.debug(f"Setting parent simulator to {sim}")
             self.simulator = sim
         
-        sim.on("Message", self.handleMessage)
+        sim.on("Message", self.handleMessage, interest=self.wantsMessage)
         sim.on("Event", self.handleEvent)
         return sim
     
@@ -51,10 +70,36 @@ class Agent(EventTarget):
         
         simulator.close()
 
+    def setThrottles(self, rates):
+        self.throttles = tuple(rates)
+        self.throttleCounter += 1
+        for simulator in self.simulators:
+            simulator.circuit.setThrottles(self.throttles)
+            self.sendThrottles(simulator)
+    
+    def sendThrottles(self, simulator):
+        """Tell a simulator how fast it may send to us."""
+        msg = self.messageTemplate.getMessage("AgentThrottle")
+        msg.AgentData.AgentID = self.agentId
+        msg.AgentData.SessionID = self.sessionId
+        msg.AgentData.CircuitCode = self.circuitCode
+        msg.Throttle.GenCounter = self.throttleCounter
+        msg.Throttle.Throttles = Throttle.pack(self.throttles)
+        simulator.send(msg, True)
+    
+    def getMetrics(self):
+        result = {}
+        for simulator in self.simulators:
+            result["{}:{}".format(*simulator.host)] = simulator.getMetrics()
+        return result
+    
     def send(self, msg, reliable):
         if self.simulator:
             self.simulator.send(msg, reliable)
     
+    def wantsMessage(self, name):
+        return name in self.SYSTEM_MESSAGES or self.hasListeners("Message", name=name)
+    
     async def handleMessage(self, sim, msg):
         if msg.name == "DisableSimulator":
             logger.debug(f"Disabling simulator {sim}")
@@ -71,7 +116,7 @@ class Agent(EventTarget):
             await self.fire("Kicked")
             await self.fire("Logout")
         
-        await self.fire("Message", sim, msg)
+        await self.fire("Message", sim, msg, name=msg.name)
     
     async def handleEvent(self, sim, name, body):
         logger.debug(f"EventQueue \"{name}\" from {sim}")
@@ -171,8 +216,6 @@ class Agent(EventTarget):
                 for simulator in self.simulators:
                     if not await simulator.ping():
                         self.removeSimulator(simulator)
-                    else:
-                        await simulator.sendAcks()
                 
                 if not self.simulator:
                     break
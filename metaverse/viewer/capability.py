@@ -7,6 +7,7 @@ class CapabilityRegistry:
     
     def register(self, name):
         def _(func):
+            func.NAME = name
             self.capabilities[name] = func
             return func
         return _
@@ -14,140 +15,176 @@ class CapabilityRegistry:
     def __contains__(self, what):
         return what in self.capabilities
     
-    def get(self, name, url):
+    def get(self, name, url, client = None):
         try:
-            return self.capabilities[name](url)
+            return self.capabilities[name](url, client)
         except KeyError:
             raise ValueError("No such capability {}".format(name))
 
 Capabilities = CapabilityRegistry()
 
 class BaseCapability:
-    def __init__(self, url):
+    NAME = None
+    # How the request scheduler treats calls to this capability
+    PRIORITY = httpclient.RequestScheduler.PRIORITY.NORMAL
+    
+    def __init__(self, url, client = None):
         self.url = url
+        # Shared HttpClient, the process wide one unless given. It is only
+        # borrowed, whoever made it closes it.
+        self._client = client
+    
+    @property
+    def client(self):
+        return self._client or httpclient.getDefaultClient()
 
 # Please keep these in alphabetical order! :)
 
 @Capabilities.register("ChatSessionRequest")
 class ChatSessionRequest(BaseCapability):
     async def acceptInvitation(self, sessionId):
-        async with httpclient.HttpClient() as session:
-            async with await session.post(self.url,
-                data = llsd.llsdEncode({
-                    "method": "accept invitation",
-                    "session-id": sessionId
-                }),
-                headers = {
-                    "Content-Type": "application/llsd+xml"
-                }
-            ) as response:
-                if response.status == 200:
-                    return True
-                
-                return False
+        session = self.client
+        async with await session.post(self.url,
+            capability = self.NAME,
+            priority = self.PRIORITY,
+            data = llsd.llsdEncode({
+                "method": "accept invitation",
+                "session-id": sessionId
+            }),
+            headers = {
+                "Content-Type": "application/llsd+xml"
+            }
+        ) as response:
+            if response.status == 200:
+                return True
+            
+            return False
     
     async def fetchHistory(self, sessionId):
         """
         This returns a array in this format:
         [{"from": ..., "from_id": ..., "message": ..., "num": ..., "time": ...}, ...]
         """
-        async with httpclient.HttpClient() as session:
-            async with await session.post(self.url,
-                data = llsd.llsdEncode({
-                    "method": "fetch history",
-                    "session-id": sessionId
-                }),
-                headers = {
-                    "Content-Type": "application/llsd+xml"
-                }
-            ) as response:
-                if response.status != 200:
-                    return []
-                
-                data = await response.read()
-                result = llsd.llsdDecode(data, format="xml")
-                return result
+        session = self.client
+        async with await session.post(self.url,
+            capability = self.NAME,
+            priority = self.PRIORITY,
+            data = llsd.llsdEncode({
+                "method": "fetch history",
+                "session-id": sessionId
+            }),
+            headers = {
+                "Content-Type": "application/llsd+xml"
+            }
+        ) as response:
+            if response.status != 200:
+                return []
+            
+            data = await response.read()
+            result = llsd.llsdDecode(data, format="xml")
+            return result
     
     async def startP2PVoice(self, sessionId, otherParticipantId):
-        async with httpclient.HttpClient() as session:
-            async with await session.post(self.url,
-                data = llsd.llsdEncode({
-                    "method": "start p2p voice",
-                    "session-id": sessionId,
-                    "params": otherParticipantId,
-                    "alt-params": {
-                        "voice_server_type": "webrtc"
-                    }
-                }),
-                headers = {
-                    "Content-Type": "application/llsd+xml"
+        session = self.client
+        async with await session.post(self.url,
+            capability = self.NAME,
+            priority = self.PRIORITY,
+            data = llsd.llsdEncode({
+                "method": "start p2p voice",
+                "session-id": sessionId,
+                "params": otherParticipantId,
+                "alt-params": {
+                    "voice_server_type": "webrtc"
                 }
-            ) as response:
-                if response.status == 200:
-                    return True
-                
-                return False
+            }),
+            headers = {
+                "Content-Type": "application/llsd+xml"
+            }
+        ) as response:
+            if response.status == 200:
+                return True
+            
+            return False
     
     async def startConference(self, sessionId, agents):
-        async with httpclient.HttpClient() as session:
-            async with await session.post(self.url,
-                data = llsd.llsdEncode({
-                    "method": "start conference",
-                    "session-id": sessionId,
-                    "params": agents,
-                    "alt-params": {
-                        "voice_server_type": "webrtc"
-                    }
-                }),
-                headers = {
-                    "Content-Type": "application/llsd+xml"
+        session = self.client
+        async with await session.post(self.url,
+            capability = self.NAME,
+            priority = self.PRIORITY,
+            data = llsd.llsdEncode({
+                "method": "start conference",
+                "session-id": sessionId,
+                "params": agents,
+                "alt-params": {
+                    "voice_server_type": "webrtc"
                 }
-            ) as response:
-                if response.status == 200:
-                    return True
-                
-                return False
+            }),
+            headers = {
+                "Content-Type": "application/llsd+xml"
+            }
+        ) as response:
+            if response.status == 200:
+                return True
+            
+            return False
 
 
 @Capabilities.register("EventQueueGet")
 class EventQueueGet(BaseCapability):
-    async def poll(self, ack, done = False):
-        async with httpclient.HttpClient() as session:
-            async with await session.post(self.url,
-                data = llsd.llsdEncode({
-                    "ack": ack,
-                    "done": done
-                }),
-                headers = {
-                    "Content-Type": "application/llsd+xml"
-                },
-                timeout = 60 # Timeouts on the server are 30, twice that is more than enough
-            ) as response:
-                if response.status == 404:
-                    return None, []
-                
-                elif response.status == 200:
-                    data = await response.read()
-                    result = llsd.llsdDecode(data, format="xml")
-                    return result["id"], result["events"]
-                
-                else:
-                    return ack, []
+    PRIORITY = httpclient.RequestScheduler.PRIORITY.POLL
+    
+    # Every poll sends the same body apart from the ack
+    BODY = llsd.XmlTemplate({
+        "ack": llsd.XmlTemplate.Field("ack"),
+        "done": llsd.XmlTemplate.Field("done")
+    })
+    
+    # Events keep naming the same agents, sessions and keys
+    INTERNER = llsd.XmlInterner()
+    
+    async def poll(self, ack, done = False, timeout = 60):
+        """
+        Returns the new ack and the events, or None and no events if the
+        queue is gone. Other failures raise httpclient.HttpError.
+        """
+        session = self.client
+        async with await session.post(self.url,
+            capability = self.NAME,
+            priority = self.PRIORITY,
+            data = self.BODY.encode(ack = ack, done = done),
+            headers = {
+                "Content-Type": "application/llsd+xml"
+            },
+            timeout = timeout
+        ) as response:
+            if response.status == 404:
+                return None, []
+            
+            elif response.status == 200:
+                data = await response.read()
+                result = llsd.llsdDecode(data, format="xml", interner=self.INTERNER)
+                return result["id"], result["events"]
+            
+            raise httpclient.HttpError(response.status, response.headers)
 
 @Capabilities.register("Seed")
 class Seed(BaseCapability):
+    PRIORITY = httpclient.RequestScheduler.PRIORITY.HIGH
+    
     async def getCapabilities(self, caps):
-        async with httpclient.HttpClient() as session:
-            async with await session.post(self.url,
-                data = llsd.llsdEncode(list(caps.capabilities.keys())),
-                headers = {
-                    "Content-Type": "application/llsd+xml"
-                }
-            ) as response:
-                capList = llsd.llsdDecode(await response.read(), format="xml")
-                result = {}
-                for name, url in capList.items():
-                    if name in caps:
-                        result[name] = caps.get(name, url)
-                
-                return result
\ No newline at end of file
+        session = self.client
+        async with await session.post(self.url,
+            capability = self.NAME,
+            priority = self.PRIORITY,
+            data = llsd.llsdEncode(list(caps.capabilities.keys())),
+            headers = {
+                "Content-Type": "application/llsd+xml"
+            }
+        ) as response:
+            capList = llsd.llsdDecode(await response.read(), format="xml")
+            result = {}
+            for name, url in capList.items():
+                if name in caps:
+                    result[name] = caps.get(name, url, self._client)
+            
+            return result
\ No newline at end of file
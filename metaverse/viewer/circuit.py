@@ -1,14 +1,58 @@
 import asyncio
+from collections import deque
 from ..eventtarget import EventTarget
+from . import messages
 from . import packet
+from .dispatch import DispatchQueue
+from .metrics import CircuitMetrics
+from .reliable import ResendQueue, SequenceWindow
+from .throttle import Throttle
+from .zerocode import zeroEncode
+
+import logging
+logger = logging.getLogger(__name__)
 
 class Circuit(asyncio.Protocol, EventTarget):
+    # Handled as soon as they arrive instead of waiting in the inbox behind
+    # whatever the listeners are busy with
+    FAST_MESSAGES = frozenset((
+        "PacketAck",
+        "StartPingCheck",
+        "CompletePingCheck"
+    ))
+    
     def __init__(self):
         super().__init__()
         self.transport = None
+        self.loop = None
         self.sequence = 0
-        self.unackd = {}
-        self.acks = []
+        self.metrics = CircuitMetrics()
+        self.unackd = ResendQueue()
+        self.resendTimer = None
+        self.messageTemplate = messages.getDefaultTemplate()
+        
+        # Acks ride along on outgoing packets, whatever is still pending
+        # after ackDelay seconds is flushed in a PacketAck
+        self.acks = deque()
+        self.ackDelay = 0.1
+        self.ackTimer = None
+        self.acksPiggybacked = 0
+        self.acksStandalone = 0
+        
+        # Packets the simulator resent because our ack was late
+        self.received = SequenceWindow()
+        self.duplicates = 0
+        
+        # Received messages are handed to listeners one at a time, in order
+        self.inbox = DispatchQueue(self.dispatchMessage)
+        
+        # Outgoing messages over their category's budget wait in the outbox,
+        # timed out reliable packets in resends, which is drained first
+        self.throttle = Throttle()
+        self.outbox = [deque() for _ in Throttle.CATEGORY]
+        self.resends = deque()
+        self.sendTimer = None
+        self.throttled = 0
     
     def nextSequence(self):
         seq = self.sequence
@@ -16,23 +60,177 @@ class Circuit(asyncio.Protocol, EventTarget):
         return seq
     
     def acknowledge(self, sequences):
+        now = self.loop.time()
         for ack in sequences:
-            if ack in self.unackd:
-                self.unackd.pop(ack)
+            sample = self.unackd.acknowledge(ack, now)
+            if sample != None:
+                self.metrics.rtt.add(sample)
+    
+    def queueAck(self, sequence):
+        self.acks.append(sequence)
+        if not self.ackTimer:
+            self.ackTimer = self.loop.call_later(self.ackDelay, self.flushAcks)
+    
+    def flushAcks(self):
+        if self.ackTimer:
+            self.ackTimer.cancel()
+            self.ackTimer = None
+        
+        while self.acks and self.transport:
+            msg = self.messageTemplate.getMessage("PacketAck")
+            count = min(len(self.acks), 255)
+            for i in range(count):
+                msg.Packets[i].ID = self.acks.popleft()
+            
+            self.acksStandalone += count
+            self.send(msg)
+    
+    def scheduleResend(self):
+        deadline = self.unackd.nextDeadline()
+        if deadline == None:
+            return
+        
+        if self.resendTimer:
+            if self.resendTimer.when() <= deadline:
+                return
+            self.resendTimer.cancel()
+        
+        self.resendTimer = self.loop.call_at(deadline, self.handleResendTimer)
+    
+    def handleResendTimer(self):
+        self.resendTimer = None
+        if not self.transport:
+            return
+        
+        now = self.loop.time()
+        self.queueResends(self.unackd.expire, now)
+    
+    def queueResends(self, expire, now):
+        lost = self.unackd.lost
+        for data in expire(now):
+            if self.resends or not self.throttle.take(Throttle.CATEGORY.RESEND, len(data), now):
+                self.resends.append(data)
+                continue
+            
+            self.transmitResend(data)
+        
+        if self.unackd.lost != lost:
+            logger.warning(f"Gave up on {self.unackd.lost - lost} reliable packets after {self.unackd.maxRetries} retries")
+        
+        self.scheduleResend()
+        self.scheduleSend()
+    
+    def transmitResend(self, data):
+        self.transport.sendto(data)
+        self.metrics.packetsOut += 1
+        self.metrics.bytesOut += len(data)
+    
+    def scheduleSend(self):
+        if self.sendTimer or not self.transport:
+            return
+        
+        now = self.loop.time()
+        delays = []
+        if self.resends:
+            delays.append(self.throttle.delay(Throttle.CATEGORY.RESEND, now))
+        for category, queue in zip(Throttle.CATEGORY, self.outbox):
+            if queue:
+                delays.append(self.throttle.delay(category, now))
+        
+        if delays:
+            self.sendTimer = self.loop.call_later(min(delays), self.handleSendTimer)
+    
+    def handleSendTimer(self):
+        self.sendTimer = None
+        if not self.transport:
+            return
+        
+        now = self.loop.time()
+        resends = self.resends
+        while resends and self.throttle.take(Throttle.CATEGORY.RESEND, len(resends[0]), now):
+            data = resends.popleft()
+            # It may have been acked while it was waiting
+            sequence = packet.Packet.sPacketHeader.unpack_from(data)[1]
+            if sequence in self.unackd:
+                self.transmitResend(data)
+        
+        for category, queue in zip(Throttle.CATEGORY, self.outbox):
+            while queue and self.throttle.take(category, len(queue[0][1]), now):
+                self.transmit(*queue.popleft())
+        
+        self.scheduleSend()
+    
+    def setThrottles(self, rates):
+        """Outbound budgets in bits per second, in AgentThrottle order."""
+        self.throttle.setRates(rates)
+        if self.sendTimer:
+            self.sendTimer.cancel()
+            self.sendTimer = None
+        self.scheduleSend()
     
     def connection_made(self, transport):
         self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.inbox.start(transport, self.loop)
 
     def datagram_received(self, data, addr):
+        self.metrics.packetsIn += 1
+        self.metrics.bytesIn += len(data)
+        
+        flags, sequence, _ = packet.Packet.sPacketHeader.unpack_from(data)
+        if flags & packet.Packet.FLAGS.RELIABLE:
+            self.queueAck(sequence)
+        
+        # Duplicates still get acked, but nothing else is done with them.
+        # Packets too old for the window to tell are let through, a resend
+        # we already acked would never come again.
+        if self.received.check(sequence):
+            self.duplicates += 1
+            return
+        
         pkt = packet.Packet.fromBytes(data)
-        if pkt.reliable:
-            self.acks.append(pkt.sequence)
+        try:
+            name = self.messageTemplate.peekMessage(pkt.body).name
+        except (KeyError, IndexError):
+            name = "Unknown"
+        self.metrics.countIn(name, len(data))
         
         # Has acks, acknowledge them!
         if pkt.flags & pkt.FLAGS.ACK:
             self.acknowledge(pkt.acks)
         
-        asyncio.create_task(self.fire("Message", addr, pkt.body))
+        if name in self.FAST_MESSAGES:
+            try:
+                self.handleFastMessage(name, pkt.body)
+            except Exception:
+                logger.exception(f"Failed to handle {name}")
+        
+        # Unreliable high frequency messages (object updates and such) are
+        # the first to go when the inbox overflows
+        if pkt.reliable:
+            priority = 2
+        elif len(pkt.body) and pkt.body[0] != 0xFF:
+            priority = 0
+        else:
+            priority = 1
+        
+        self.inbox.put((addr, pkt.body), priority)
+    
+    def handleFastMessage(self, name, body):
+        msg = self.messageTemplate.loadMessage(body)
+        if name == "PacketAck":
+            self.acknowledge([block.ID for block in msg.Packets])
+        
+        elif name == "StartPingCheck":
+            reply = self.messageTemplate.getMessage("CompletePingCheck")
+            reply.PingID.PingID = msg.PingID.PingID
+            self.send(reply)
+        
+        elif name == "CompletePingCheck":
+            self.fireSync("Pong", msg.PingID.PingID)
+    
+    async def dispatchMessage(self, addr, body):
+        await self.fire("Message", addr, body)
 
     def error_received(self, exc):
         asyncio.create_task(self.fire("Error", exc))
@@ -42,6 +240,7 @@ class Circuit(asyncio.Protocol, EventTarget):
             return
         
         self.transport = None
+        self.cancelTimers()
         asyncio.create_task(self.fire("Close", exc))
     
     def close(self):
@@ -50,31 +249,119 @@ class Circuit(asyncio.Protocol, EventTarget):
         
         self.transport.close()
         self.transport = None
+        self.cancelTimers()
         asyncio.create_task(self.fire("Close", None))
     
+    def cancelTimers(self):
+        self.inbox.close()
+        if self.resendTimer:
+            self.resendTimer.cancel()
+            self.resendTimer = None
+        
+        if self.ackTimer:
+            self.ackTimer.cancel()
+            self.ackTimer = None
+        
+        if self.sendTimer:
+            self.sendTimer.cancel()
+            self.sendTimer = None
+        
+        self.resends.clear()
+        for queue in self.outbox:
+            queue.clear()
+    
     def send(self, message, reliable = False):
         if not self.transport:
             return
         
-        pkt = packet.Packet(self.nextSequence(), bytes(message), acks=self.acks)
+        flags = 0
         if reliable:
-            pkt.reliable = True
-            self.unackd[pkt.sequence] = pkt
+            flags |= packet.Packet.FLAGS.RELIABLE
+        
+        # The body is serialized right away so the message can be reused,
+        # behind room for the header, which is filled in with the acks when
+        # it actually goes out
+        header = packet.Packet.sPacketHeader.size
+        body = bytearray(header)
+        message.toBuffer(body, True)
+        if message.encoding == message.ENCODING.ZEROCODED:
+            # Like the viewer, only zero code if it actually saves space
+            with memoryview(body) as view:
+                encoded = zeroEncode(view[header:])
+            if len(encoded) < len(body) - header:
+                flags |= packet.Packet.FLAGS.ZEROCODE
+                del body[header:]
+                body += encoded
         
-        self.transport.sendto(pkt.toBytes())
+        category = self.throttle.classify(message.name)
+        if category != None:
+            queue = self.outbox[category]
+            if queue or not self.throttle.take(category, len(body), self.loop.time()):
+                queue.append((message.name, body, flags))
+                self.throttled += 1
+                self.scheduleSend()
+                return
+        
+        self.transmit(message.name, body, flags)
+    
+    def transmit(self, name, buf, flags):
+        # The whole datagram is put together in the buffer send() made
+        sequence = self.nextSequence()
+        if self.acks:
+            count = packet.Packet.appendAcks(buf, self.acks)
+            if count:
+                flags |= packet.Packet.FLAGS.ACK
+                self.acksPiggybacked += count
+        
+        packet.Packet.sPacketHeader.pack_into(buf, 0, flags, sequence, 0)
+        self.transport.sendto(buf)
+        self.metrics.countOut(name, len(buf))
+        
+        # The RESENT flag gets patched into this same buffer when it times out
+        if flags & packet.Packet.FLAGS.RELIABLE:
+            self.metrics.reliableSent += 1
+            self.unackd.add(sequence, buf, self.loop.time())
+            self.scheduleResend()
     
     def resend(self, distance = 100):
+        """
+        Immediately resend reliable packets that are more than distance
+        sequence numbers old, without waiting for their timeouts.
+        """
         if not self.transport:
             return
         
         cutoff = self.sequence - distance
-        for pkt in self.unackd.values():
-            if pkt.sequence < cutoff:
-                pkt.resent = True
-                self.transport.sendto(pkt.toBytes())
+        self.queueResends(lambda now: self.unackd.expireBefore(cutoff, now), self.loop.time())
+    
+    def getMetrics(self):
+        result = self.metrics.snapshot()
+        result.update({
+            "resent": self.unackd.resent,
+            "lost": self.unackd.lost,
+            "unacked": len(self.unackd),
+            "srtt": self.unackd.rtt.srtt,
+            "rto": self.unackd.rtt.rto,
+            "duplicates": self.duplicates,
+            "acksPiggybacked": self.acksPiggybacked,
+            "acksStandalone": self.acksStandalone,
+            "acksPending": len(self.acks),
+            "throttled": self.throttled,
+            "outbox": sum(len(queue) for queue in self.outbox) + len(self.resends),
+            "inbox": {
+                "depth": len(self.inbox),
+                "highWater": self.inbox.highWater,
+                "dropped": self.inbox.dropped
+            }
+        })
+        return result
     
     @classmethod
-    async def create(cls, host, loop = None):
+    async def create(cls, host, loop = None, pool = None, circuitCode = None):
+        # Either a socket of its own, or one shared through a SocketPool
+        if pool != None:
+            return await pool.attach(cls(), host, circuitCode, loop)
+        
         loop = loop or asyncio.get_running_loop()
         transport, protocol = await loop.create_datagram_endpoint(
             lambda: cls(),
@@ -0,0 +1,128 @@
+import asyncio
+from collections import deque
+from enum import Enum, auto
+
+import logging
+logger = logging.getLogger(__name__)
+
+class DispatchQueue:
+    """
+    Bounded queue of received messages, drained in arrival order by a single
+    task. When it is full the policy decides what gives.
+    """
+    class POLICY(Enum):
+        # Drop the oldest queued message
+        DROP_OLDEST = auto()
+        # Drop the oldest message of the lowest priority
+        PRIORITY = auto()
+        # Stop reading from the socket until the queue drained
+        BACKPRESSURE = auto()
+
+    # Unreliable high frequency, other unreliable, reliable
+    PRIORITIES = 3
+
+    def __init__(self, handler, maxsize = 4096, policy = None):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy or self.POLICY.DROP_OLDEST
+        self.lanes = [deque() for _ in range(self.PRIORITIES)]
+        self.size = 0
+        self.order = 0
+        self.highWater = 0
+        self.dropped = 0
+        self.transport = None
+        self.paused = False
+        self.wakeup = None
+        self.task = None
+
+    def __len__(self):
+        return self.size
+
+    def start(self, transport = None, loop = None):
+        loop = loop or asyncio.get_running_loop()
+        self.transport = transport
+        self.wakeup = asyncio.Event()
+        if self.size:
+            self.wakeup.set()
+        self.task = loop.create_task(self.run())
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def put(self, args, priority = 0):
+        if self.policy != self.POLICY.PRIORITY:
+            priority = 0
+
+        if self.size >= self.maxsize and not self.overflow(priority):
+            self.dropped += 1
+            return False
+
+        self.order += 1
+        self.lanes[priority].append((self.order, args))
+        self.size += 1
+        if self.size > self.highWater:
+            self.highWater = self.size
+
+        if self.wakeup:
+            self.wakeup.set()
+        return True
+
+    def overflow(self, priority):
+        """Make room for one more message, False if it should be dropped instead."""
+        if self.policy == self.POLICY.BACKPRESSURE and self.pause():
+            return True
+        return self.makeRoom(priority)
+
+    def makeRoom(self, priority):
+        # Never push out something more important than what is coming in
+        for lane in self.lanes[:priority + 1]:
+            if lane:
+                lane.popleft()
+                self.size -= 1
+                self.dropped += 1
+                return True
+        return False
+
+    def pause(self):
+        if self.paused:
+            return True
+
+        # Not every transport can be paused, those fall back to dropping
+        if not self.transport or not hasattr(self.transport, "pause_reading"):
+            return False
+
+        self.transport.pause_reading()
+        self.paused = True
+        return True
+
+    def resume(self):
+        self.paused = False
+        if self.transport:
+            self.transport.resume_reading()
+
+    def get(self):
+        best = None
+        for lane in self.lanes:
+            if lane and (best == None or lane[0][0] < best[0][0]):
+                best = lane
+
+        self.size -= 1
+        return best.popleft()[1]
+
+    async def run(self):
+        while True:
+            if not self.size:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            args = self.get()
+            if self.paused and self.size <= self.maxsize // 2:
+                self.resume()
+
+            try:
+                await self.handler(*args)
+            except Exception:
+                logger.exception("Unhandled exception while dispatching message")
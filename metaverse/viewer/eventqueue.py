@@ -1,36 +1,142 @@
 import asyncio
+import random
+from collections import deque
 from ..eventtarget import EventTarget
+from .. import httpclient
+
+import logging
+logger = logging.getLogger(__name__)
 
 class EventQueue(EventTarget):
+    # The server holds a poll for about 30 seconds before answering with 502
+    POLL_TIMEOUT = 45
+    # A 502 sooner than this was not a held poll timing out, but an error
+    IDLE_MINIMUM = 5
+    # Exponential backoff on errors, with full jitter so that a region
+    # restart doesn't make every agent come back at the same time
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 60.0
+    
     def __init__(self, simulator):
         super().__init__()
         self.simulator = simulator
         self.sequence = 0
         self.task = None
+        self.failures = 0
+        
+        # Events are dispatched by their own task so the next poll can go
+        # out right away
+        self.pending = deque()
+        self.wakeup = None
+        self.dispatcher = None
+        # Telling the server we are done, outlives the queue itself
+        self.doneTask = None
     
     async def handleEvent(self, event):
         await self.fire("Event", event["message"], event["body"])
-
+    
+    async def dispatch(self):
+        while True:
+            while self.pending:
+                try:
+                    await self.handleEvent(self.pending.popleft())
+                except Exception:
+                    logger.exception("Unhandled exception while dispatching event")
+            
+            self.wakeup.clear()
+            await self.wakeup.wait()
+    
+    def backoff(self, retryAfter = None):
+        self.failures += 1
+        delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** self.failures))
+        if retryAfter != None:
+            delay = max(delay, retryAfter)
+        return delay
+    
     async def run(self):
+        capability = self.simulator.capabilities.get("EventQueueGet")
+        if not capability:
+            logger.warning(f"{self.simulator} has no EventQueueGet capability")
+            return
+        
+        loop = asyncio.get_running_loop()
         while True:
-            if not "EventQueueGet" in self.simulator.capabilities:
-                await asyncio.sleep(0.1)
+            start = loop.time()
+            try:
+                ack, events = await capability.poll(self.sequence, False, self.POLL_TIMEOUT)
+            
+            except asyncio.TimeoutError:
+                # Nothing happened for a while, same as a 502
+                continue
+            
+            except httpclient.HttpError as e:
+                if e.status in (499, 502) and loop.time() - start >= self.IDLE_MINIMUM:
+                    self.failures = 0
+                    continue
+                
+                delay = self.backoff(e.retryAfter)
+                logger.debug(f"Event queue poll of {self.simulator} failed with {e.status}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
             
-            ack, events = await self.simulator.capabilities["EventQueueGet"].poll(self.sequence, False)
+            except httpclient.NETWORK_ERRORS as e:
+                delay = self.backoff()
+                logger.debug(f"Event queue poll of {self.simulator} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            
+            self.failures = 0
             if ack == None:
+                logger.debug(f"Event queue of {self.simulator} is gone")
                 return
             
-            for event in events:
-                await self.handleEvent(event)
-            
             self.sequence = ack
+            if events:
+                self.pending.extend(events)
+                self.wakeup.set()
+    
+    async def sendDone(self, capability):
+        # Let the server know we are done so it can drop the queue
+        try:
+            await capability.poll(self.sequence, True, self.IDLE_MINIMUM)
+        except (asyncio.TimeoutError, httpclient.HttpError, *httpclient.NETWORK_ERRORS):
+            pass
     
     def start(self, loop = None):
         loop = loop or asyncio.get_running_loop()
-        if self.task:
-            self.task.cancel()
+        self.stop()
+        self.failures = 0
+        self.wakeup = asyncio.Event()
+        self.dispatcher = loop.create_task(self.dispatch())
         self.task = loop.create_task(self.run())
-        
+    
+    def stop(self):
+        for task in (self.task, self.dispatcher):
+            if task:
+                task.cancel()
+        self.task = None
+        self.dispatcher = None
+    
     def close(self):
-        if self.task:
-            self.task.cancel()
\ No newline at end of file
+        running = self.task != None
+        self.stop()
+        
+        capability = self.simulator.capabilities.get("EventQueueGet")
+        if running and capability:
+            try:
+                self.doneTask = asyncio.get_running_loop().create_task(self.sendDone(capability))
+            except RuntimeError:
+                # No loop left to send it with
+                return
+            self.doneTask.add_done_callback(self.handleDone)
+    
+    def handleDone(self, task):
+        if task is self.doneTask:
+            self.doneTask = None
+        if not task.cancelled() and task.exception():
+            logger.error(f"Failed to close the event queue of {self.simulator}", exc_info=task.exception())
+    
+    async def waitClosed(self):
+        """Wait for the server to be told the queue is done with."""
+        if self.doneTask:
+            await asyncio.shield(self.doneTask)
@@ -4,51 +4,17 @@ from enum import Enum, auto
 import ipaddress
 import uuid
 import struct
-import io
 import os
+from .zerocode import zeroEncode, zeroDecode
 
 # These are shared in various places around the code
 sUInt32 = struct.Struct(">I")
 sUInt16 = struct.Struct(">H")
 sUInt8 = struct.Struct(">B")
 
-def ZeroEncode(buf):
-    output = io.BytesIO()
-    count = None
-    i = 0
-    l = len(buf)
-    count = 0
-    while i < l:
-        if buf[i] == 0:
-            count = 0
-            while i < l and buf[i] == 0:
-                count += 1
-                i += 1
-                if count == 255:
-                    output.write(bytes([0, 0xFF]))
-                    count = 0
-            if count != 0:
-                output.write(bytes([0, count]))
-        if i < l:
-            output.write(bytes([buf[i]]))
-        i += 1
-    
-    return output.getvalue()
-
-def ZeroDecode(buf):
-    output = io.BytesIO()
-    count = None
-    i = 0
-    l = len(buf)
-    while i < l:
-        if buf[i] == 0:
-            i += 1
-            output.write(bytes(buf[i]))
-        else:
-            output.write(bytes([buf[i]]))
-        i += 1
-    
-    return output.getvalue()
+# Kept for compatibility, see zerocode.py
+ZeroEncode = zeroEncode
+ZeroDecode = zeroDecode
 
 
 class Block:
@@ -98,10 +64,11 @@ class Block:
     sLLVector3d = struct.Struct("<ddd")
     sLLVector4 = struct.Struct("<ffff")
     
-    def __init__(self, name):
+    def __init__(self, name, parameters = None, codec = None):
         super().__setattr__('name', name)
-        super().__setattr__('parameters', OrderedDict())
+        super().__setattr__('parameters', parameters if parameters is not None else OrderedDict())
         super().__setattr__('values', {})
+        super().__setattr__('codec', codec)
     
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.name}>"
@@ -118,199 +85,44 @@ class Block:
             super().__setattr__(name, value)  # Prevent infinite recursion
     
     def __bytes__(self):
-        res = io.BytesIO()
-        self.toStream(res)
-        return res.getvalue()
+        buf = bytearray()
+        self.toBuffer(buf)
+        return bytes(buf)
+    
+    def compile(self):
+        codec = BlockCodec(self.parameters)
+        super().__setattr__('codec', codec)
+        return codec
+    
+    def toBuffer(self, buf):
+        (self.codec or self.compile()).encode(self.values, buf)
+    
+    def fromBuffer(self, buf, offset = 0, lazy = False):
+        codec = self.codec or self.compile()
+        if lazy:
+            super().__setattr__('values', LazyValues(codec, buf, offset))
+            return codec.skip(buf, offset)
+        
+        return codec.decode(buf, offset, self.values)
     
     def toStream(self, handle):
-        for name, (dType, size) in self.parameters.items():
-            if dType == self.TYPE.NULL:
-                pass
-            
-            elif dType == self.TYPE.FIXED:
-                data = self.values.get(name, b"")[:size]
-                handle.write(data.ljust(size, b'\x00'))
-            
-            elif dType == self.TYPE.VARIABLE:
-                if size == 1:
-                    data = self.values.get(name, b"")[:255]
-                    handle.write(self.sVariable1.pack(len(data)))
-                    handle.write(data)
-                    
-                elif size == 2:
-                    data = self.values.get(name, b"")[:65535]
-                    handle.write(self.sVariable2.pack(len(data)))
-                    handle.write(data)
-                    
-                else:
-                    raise Exception("Invalid variable size {}".format(size))
-            
-            elif dType == self.TYPE.U8:
-                handle.write(self.sU8.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.U16:
-                handle.write(self.sU16.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.U32:
-                handle.write(self.sU32.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.U64:
-                handle.write(self.sU64.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.S8:
-                handle.write(self.sS8.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.S16:
-                handle.write(self.sS16.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.S32:
-                handle.write(self.sS32.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.S64:
-                handle.write(self.sS64.pack(int(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.F32:
-                handle.write(self.sF32.pack(float(self.values.get(name, 0) or 0)))
-                
-            elif dType == self.TYPE.F64:
-                handle.write(self.sF64.pack(float(self.values.get(name, 0) or 0)))
-            
-            elif dType == self.TYPE.LLVECTOR3:
-                vec = self.values.get(name, (0,0,0)) or (0,0,0)
-                handle.write(self.sLLVector3.pack(vec[0], vec[1], vec[2]))
-            
-            elif dType == self.TYPE.LLVECTOR3D:
-                vec = self.values.get(name, (0,0,0)) or (0,0,0)
-                handle.write(self.sLLVector3d.pack(vec[0], vec[1], vec[2]))
-            
-            elif dType == self.TYPE.LLVECTOR4:
-                vec = self.values.get(name, (0,0,0,0)) or (0,0,0,0)
-                handle.write(self.sLLVector4.pack(vec[0], vec[1], vec[2], vec[3]))
-            
-            elif dType == self.TYPE.LLQUATERNION:
-                vec = self.values.get(name, (0,0,0)) or (0,0,0)
-                # NOTE: Quaternions are transmitted as vectors. The W component
-                # is missing and is just generated on the fly.
-                handle.write(self.sLLVector3.pack(vec[0], vec[1], vec[2]))
-            
-            elif dType == self.TYPE.LLUUID:
-                value = self.values.get(name, "00000000-0000-0000-0000-000000000000") or "00000000-0000-0000-0000-000000000000"
-                if type(value) == str:
-                    value = uuid.UUID(value)
-                handle.write(value.bytes)
-            
-            elif dType == self.TYPE.BOOL:
-                handle.write(b"\1" if bool(self.values.get(name, False) or False) else b"\0")
-            
-            # NOTE: IPADDR AND IPPORT USE THE BIG ENDIAN sUInt32 AND sUInt16
-            # THESE ARE NOT FROM THE MESSAGE CLASS, THEY ARE FROM THE GLOBAL SCOPE!
-            # IT IS INTENTIONAL!
-            elif dType == self.TYPE.IPADDR:
-                handle.write(sUInt32.pack(int(ipaddress.IPv4Address(self.values.get(name, "0.0.0.0") or "0.0.0.0"))))
-            
-            elif dType == self.TYPE.IPPORT:
-                handle.write(sUInt16.pack(int(self.values.get(name, 0) or 0)&0xFFFF))
-            
-            else:
-                raise Exception("Unknown type {}".format(dType))
+        handle.write(bytes(self))
     
     def fromStream(self, handle):
-        for name, (dType, size) in self.parameters.items():
-            if dType == self.TYPE.NULL:
-                pass
-            
-            elif dType == self.TYPE.FIXED:
-                data = handle.read(size)
-            
-            elif dType == self.TYPE.VARIABLE:
-                if size == 1:
-                    dataSize, = self.sVariable1.unpack(handle.read(self.sVariable1.size))
-                    data = handle.read(dataSize)
-                    
-                elif size == 2:
-                    dataSize, = self.sVariable2.unpack(handle.read(self.sVariable2.size))
-                    data = handle.read(dataSize)
-                    
-                else:
-                    raise Exception("Invalid variable size {}".format(size))
-            
-            elif dType == self.TYPE.U8:
-                data, = self.sU8.unpack(handle.read(self.sU8.size))
-            
-            elif dType == self.TYPE.U16:
-                data, = self.sU16.unpack(handle.read(self.sU16.size))
-            
-            elif dType == self.TYPE.U32:
-                data, = self.sU32.unpack(handle.read(self.sU32.size))
-            
-            elif dType == self.TYPE.U64:
-                data, = self.sU64.unpack(handle.read(self.sU64.size))
-            
-            elif dType == self.TYPE.S8:
-                data, = self.sS8.unpack(handle.read(self.sS8.size))
-            
-            elif dType == self.TYPE.S16:
-                data, = self.sS16.unpack(handle.read(self.sS16.size))
-            
-            elif dType == self.TYPE.S32:
-                data, = self.sS32.unpack(handle.read(self.sS32.size))
-            
-            elif dType == self.TYPE.S64:
-                data, = self.sS64.unpack(handle.read(self.sS64.size))
-            
-            elif dType == self.TYPE.F32:
-                data, = self.sF32.unpack(handle.read(self.sF32.size))
-                
-            elif dType == self.TYPE.F64:
-                data, = self.sF64.unpack(handle.read(self.sF64.size))
-            
-            elif dType == self.TYPE.LLVECTOR3:
-                data = self.sLLVector3.unpack(handle.read(self.sLLVector3.size))
-            
-            elif dType == self.TYPE.LLVECTOR3D:
-                data = self.sLLVector3D.unpack(handle.read(self.sLLVector3D.size))
-            
-            elif dType == self.TYPE.LLVECTOR4:
-                data = self.sLLVector4.unpack(handle.read(self.sLLVector4.size))
-            
-            elif dType == self.TYPE.LLQUATERNION:
-                # NOTE: Quaternions are transmitted as vectors. The W component
-                # is missing and is just generated on the fly.
-                data = self.sLLVector3.unpack(handle.read(self.sLLVector3.size))
-            
-            elif dType == self.TYPE.LLUUID:
-                data = uuid.UUID(bytes=handle.read(16))
-            
-            elif dType == self.TYPE.BOOL:
-                data = handle.read(1)[0] != 0
-            
-            # NOTE: IPADDR AND IPPORT USE THE BIG ENDIAN sUInt32 AND sUInt16
-            # THESE ARE NOT FROM THE MESSAGE CLASS, THEY ARE FROM THE GLOBAL SCOPE!
-            # IT IS INTENTIONAL!
-            elif dType == self.TYPE.IPADDR:
-                data = ipaddress.IPv4Address(sUInt32.unpack(handle.read(sUInt32.size))[0])
-            
-            elif dType == self.TYPE.IPPORT:
-                data, = sUInt16.unpack(handle.read(sUInt16.size))
-            
-            else:
-                raise Exception("Unknown type {}".format(dType))
-            
-            self.values[name] = data
+        start = handle.tell()
+        handle.seek(start + self.fromBuffer(handle.read()))
     
     def registerParameter(self, name, dType, size):
         self.parameters[name] = (dType, size)
+        super().__setattr__('codec', None)
     
     def copy(self):
-        block = Block(self.name)
-        block.parameters = self.parameters
-        
-        return block
+        return Block(self.name, self.parameters, self.codec)
 
 
 class BlockArray(Block):
-    def __init__(self, name, count = None):
-        super().__init__(name)
+    def __init__(self, name, count = None, parameters = None, codec = None):
+        super().__init__(name, parameters, codec)
         self.count = count
         self.blocks = []
     
@@ -321,9 +133,10 @@ class BlockArray(Block):
         if self.count != None and i > self.count:
             raise IndexError("block index out of range")
         
-        for _ in range(len(self.blocks), i + 1):
-            self.blocks.append(Block(self.name))
-            self.blocks[-1].parameters = self.parameters
+        if i >= len(self.blocks):
+            codec = self.codec or self.compile()
+            for _ in range(len(self.blocks), i + 1):
+                self.blocks.append(Block(self.name, self.parameters, codec))
                 
         return self.blocks[i]
     
@@ -334,26 +147,368 @@ class BlockArray(Block):
         for i in range(len(self)):
             yield self[i]
     
-    def toStream(self, handle):
+    def toBuffer(self, buf):
         if self.count == None:
-            handle.write(sUInt8.pack(len(self)))
+            buf += sUInt8.pack(len(self))
         
+        codec = self.codec or self.compile()
         for i in range(self.count or len(self.blocks)):
-            self[i].toStream(handle)
+            codec.encode(self[i].values, buf)
     
-    def fromStream(self, handle):
+    def fromBuffer(self, buf, offset = 0, lazy = False):
         count = self.count
         if count == None:
-            count, = sUInt8.unpack(handle.read(sUInt8.size))
+            count, = sUInt8.unpack_from(buf, offset)
+            offset += sUInt8.size
         
+        if lazy:
+            for i in range(count):
+                offset = self[i].fromBuffer(buf, offset, True)
+            return offset
+        
+        codec = self.codec or self.compile()
         for i in range(count):
-            self[i].fromStream(handle)
+            offset = codec.decode(buf, offset, self[i].values)
+        
+        return offset
     
     def copy(self):
-        block = BlockArray(self.name, self.count)
-        block.parameters = self.parameters
+        return BlockArray(self.name, self.count, self.parameters, self.codec)
+
+
+def _decodeUUID(value):
+    return uuid.UUID(bytes=value)
+
+def _decodeIPPort(value):
+    return (value[0] << 8) | value[1]
+
+def _encodeInt(value):
+    return int(value or 0)
+
+def _encodeFloat(value):
+    return float(value or 0)
+
+def _encodeBool(value):
+    return bool(value or False)
+
+def _encodeVector3(value):
+    vec = value or (0,0,0)
+    return (vec[0], vec[1], vec[2])
+
+def _encodeVector4(value):
+    vec = value or (0,0,0,0)
+    return (vec[0], vec[1], vec[2], vec[3])
+
+def _encodeUUID(value):
+    value = value or "00000000-0000-0000-0000-000000000000"
+    if type(value) == str:
+        value = uuid.UUID(value)
+    return value.bytes
+
+def _encodeFixed(value):
+    # struct takes care of truncating and null padding "Ns" fields
+    return value or b""
+
+# NOTE: IPADDR AND IPPORT ARE BIG ENDIAN, UNLIKE EVERYTHING ELSE IN A BLOCK.
+# They are packed as raw bytes so they can share a little endian run.
+def _encodeIPAddr(value):
+    return ipaddress.IPv4Address(value or "0.0.0.0").packed
+
+def _encodeIPPort(value):
+    return (int(value or 0) & 0xFFFF).to_bytes(2, "big")
+
+
+class FixedRun:
+    """
+    A run of consecutive fixed size parameters, packed and unpacked with a
+    single struct.Struct.
+    """
+    def __init__(self):
+        self.format = "<"
+        self.count = 0
+        self.names = []
+        self.fields = []
+        self.encoders = []
+        self.lookup = {}
+        self.struct = None
+        self.size = 0
+        self.plain = True
+    
+    def add(self, name, format, width, decoder, encoder):
+        self.fields.append((name, self.count if width == 1 else slice(self.count, self.count + width), decoder))
+        self.encoders.append((name, width, encoder))
+        self.lookup[name] = (struct.calcsize(self.format), struct.Struct("<" + format), width, decoder)
+        self.names.append(name)
+        self.format += format
+        self.count += width
+        if width != 1 or decoder:
+            self.plain = False
+    
+    def finalize(self):
+        self.struct = struct.Struct(self.format)
+        self.size = self.struct.size
+    
+    def decode(self, buf, offset, values):
+        data = self.struct.unpack_from(buf, offset)
+        if self.plain:
+            values.update(zip(self.names, data))
+        else:
+            for name, index, decoder in self.fields:
+                value = data[index]
+                if decoder:
+                    value = decoder(value)
+                values[name] = value
+        
+        return offset + self.size
+    
+    def decodeField(self, name, buf, offset):
+        start, fieldStruct, width, decoder = self.lookup[name]
+        value = fieldStruct.unpack_from(buf, offset + start)
+        if width == 1:
+            value = value[0]
+        if decoder:
+            value = decoder(value)
+        return value
+    
+    def skip(self, buf, offset):
+        return offset + self.size
+    
+    def encode(self, values, out):
+        args = []
+        for name, width, encoder in self.encoders:
+            if width == 1:
+                args.append(encoder(values.get(name)))
+            else:
+                args.extend(encoder(values.get(name)))
+        out += self.struct.pack(*args)
+
+
+class VariableField:
+    """
+    A length prefixed parameter, these split a block into multiple runs.
+    """
+    def __init__(self, name, size):
+        self.name = name
+        if size == 1:
+            self.struct = Block.sVariable1
+        elif size == 2:
+            self.struct = Block.sVariable2
+        else:
+            raise Exception("Invalid variable size {}".format(size))
+        self.limit = (1 << (size * 8)) - 1
+    
+    def decode(self, buf, offset, values):
+        size, = self.struct.unpack_from(buf, offset)
+        offset += self.struct.size
+        values[self.name] = bytes(buf[offset:offset + size])
+        return offset + size
+    
+    def decodeField(self, name, buf, offset):
+        size, = self.struct.unpack_from(buf, offset)
+        offset += self.struct.size
+        return bytes(buf[offset:offset + size])
+    
+    def skip(self, buf, offset):
+        size, = self.struct.unpack_from(buf, offset)
+        return offset + self.struct.size + size
+    
+    def encode(self, values, out):
+        data = (values.get(self.name) or b"")[:self.limit]
+        out += self.struct.pack(len(data))
+        out += data
+
+
+class UnknownField:
+    def __init__(self, dType):
+        self.dType = dType
+    
+    def decode(self, buf, offset, values):
+        raise Exception("Unknown type {}".format(self.dType))
+    
+    decodeField = skip = decode
+    
+    def encode(self, values, out):
+        raise Exception("Unknown type {}".format(self.dType))
+
+
+class BlockCodec:
+    """
+    Encoder and decoder for the parameters of a block, compiled once from the
+    template instead of walking the parameter types for every field.
+    """
+    # Format, width, decoder, encoder
+    FIELDS = {
+        Block.TYPE.U8: ("B", 1, None, _encodeInt),
+        Block.TYPE.U16: ("H", 1, None, _encodeInt),
+        Block.TYPE.U32: ("I", 1, None, _encodeInt),
+        Block.TYPE.U64: ("Q", 1, None, _encodeInt),
+        Block.TYPE.S8: ("b", 1, None, _encodeInt),
+        Block.TYPE.S16: ("h", 1, None, _encodeInt),
+        Block.TYPE.S32: ("i", 1, None, _encodeInt),
+        Block.TYPE.S64: ("q", 1, None, _encodeInt),
+        Block.TYPE.F32: ("f", 1, None, _encodeFloat),
+        Block.TYPE.F64: ("d", 1, None, _encodeFloat),
+        Block.TYPE.LLVECTOR3: ("3f", 3, None, _encodeVector3),
+        Block.TYPE.LLVECTOR3D: ("3d", 3, None, _encodeVector3),
+        Block.TYPE.LLVECTOR4: ("4f", 4, None, _encodeVector4),
+        # NOTE: Quaternions are transmitted as vectors. The W component
+        # is missing and is just generated on the fly.
+        Block.TYPE.LLQUATERNION: ("3f", 3, None, _encodeVector3),
+        Block.TYPE.LLUUID: ("16s", 1, _decodeUUID, _encodeUUID),
+        Block.TYPE.BOOL: ("?", 1, None, _encodeBool),
+        Block.TYPE.IPADDR: ("4s", 1, ipaddress.IPv4Address, _encodeIPAddr),
+        Block.TYPE.IPPORT: ("2s", 1, _decodeIPPort, _encodeIPPort),
+    }
+    
+    def __init__(self, parameters):
+        self.segments = []
+        self.fields = {}
+        run = None
+        for name, (dType, size) in parameters.items():
+            if dType == Block.TYPE.NULL:
+                continue
+            
+            if dType == Block.TYPE.FIXED:
+                field = ("{}s".format(size), 1, None, _encodeFixed)
+            else:
+                field = self.FIELDS.get(dType)
+            
+            if field:
+                if not run:
+                    run = FixedRun()
+                    self.segments.append(run)
+                run.add(name, *field)
+                self.fields[name] = len(self.segments) - 1
+                continue
+            
+            run = None
+            if dType == Block.TYPE.VARIABLE:
+                self.segments.append(VariableField(name, size))
+            else:
+                self.segments.append(UnknownField(dType))
+            self.fields[name] = len(self.segments) - 1
+        
+        # Blocks without variable parameters have a constant size
+        self.size = 0
+        for segment in self.segments:
+            if type(segment) == FixedRun:
+                segment.finalize()
+                if self.size != None:
+                    self.size += segment.size
+            else:
+                self.size = None
+        
+        # Skipping over a block only needs the variable length prefixes, so
+        # fixed runs are folded into the variable parameter that follows them
+        self.steps = []
+        fixed = 0
+        for segment in self.segments:
+            if type(segment) == FixedRun:
+                fixed += segment.size
+            elif type(segment) == VariableField:
+                self.steps.append((fixed, segment.struct))
+                fixed = 0
+            else:
+                self.steps = None
+                break
+        else:
+            self.steps.append((fixed, None))
+    
+    def decode(self, buf, offset, values):
+        for segment in self.segments:
+            offset = segment.decode(buf, offset, values)
+        return offset
+    
+    def skip(self, buf, offset):
+        if self.size != None:
+            return offset + self.size
+        
+        if self.steps == None:
+            for segment in self.segments:
+                offset = segment.skip(buf, offset)
+            return offset
+        
+        for fixed, prefix in self.steps:
+            offset += fixed
+            if prefix:
+                size, = prefix.unpack_from(buf, offset)
+                offset += prefix.size + size
+        return offset
+    
+    def locate(self, buf, offset):
+        offsets = []
+        for segment in self.segments:
+            offsets.append(offset)
+            offset = segment.skip(buf, offset)
+        return offsets
+    
+    def encode(self, values, out):
+        for segment in self.segments:
+            segment.encode(values, out)
+
+
+class LazyValues(dict):
+    """
+    Parameter values of a received block that are only decoded when they are
+    first accessed. Values that are assigned take precedence over the buffer.
+    """
+    def __init__(self, codec, buf, offset):
+        super().__init__()
+        self.codec = codec
+        self.buf = buf
+        self.offset = offset
+        self.offsets = None
+    
+    def __missing__(self, name):
+        if name not in self.codec.fields:
+            raise KeyError(name)
         
-        return block
+        # Only blocks containing variable parameters need to be walked
+        index = self.codec.fields[name]
+        if self.codec.size != None:
+            offset = self.offset
+        else:
+            if self.offsets == None:
+                self.offsets = self.codec.locate(self.buf, self.offset)
+            offset = self.offsets[index]
+        
+        value = self.codec.segments[index].decodeField(name, self.buf, offset)
+        self[name] = value
+        return value
+    
+    def __contains__(self, name):
+        return super().__contains__(name) or name in self.codec.fields
+    
+    def get(self, name, default = None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+    
+    def materialize(self):
+        for name in self.codec.fields:
+            self[name]
+    
+    def __iter__(self):
+        self.materialize()
+        return super().__iter__()
+    
+    def __len__(self):
+        self.materialize()
+        return super().__len__()
+    
+    def keys(self):
+        self.materialize()
+        return super().keys()
+    
+    def values(self):
+        self.materialize()
+        return super().values()
+    
+    def items(self):
+        self.materialize()
+        return super().items()
+
 
 class Message:
     class FREQUENCY(Enum):
@@ -392,39 +547,48 @@ class Message:
         return self.blocks[name]
     
     def __bytes__(self):
-        buf = io.BytesIO()
-        self.toStream(buf, True)
-        return buf.getvalue()
+        buf = bytearray()
+        self.toBuffer(buf, True)
+        return bytes(buf)
     
-    def toStream(self, handle, writeID = False):
+    def toBuffer(self, buf, writeID = False):
         if writeID:
             if self.frequency == self.FREQUENCY.LOW:
-                handle.write(sUInt32.pack(self.id))
+                buf += sUInt32.pack(self.id)
             elif self.frequency == self.FREQUENCY.MEDIUM:
-                handle.write(sUInt16.pack(self.id))
+                buf += sUInt16.pack(self.id)
             elif self.frequency == self.FREQUENCY.HIGH:
-                handle.write(sUInt8.pack(self.id))
+                buf += sUInt8.pack(self.id)
         
         for block in self.blocks.values():
-            block.toStream(handle)
+            block.toBuffer(buf)
     
-    def load(self, handle, readID = False):
+    def toStream(self, handle, writeID = False):
+        buf = bytearray()
+        self.toBuffer(buf, writeID)
+        handle.write(buf)
+    
+    def fromBuffer(self, buf, offset = 0, readID = False, lazy = False):
         if readID:
             # This doesn't do anything.
             # Perhaps we could verify the ID?
-            if self.frequency == self.FREQUENCY.LOW:
-                handle.read(sUInt32.size)
-            elif self.frequency == self.FREQUENCY.MEDIUM:
-                handle.read(sUInt16.size)
-            elif self.frequency == self.FREQUENCY.HIGH:
-                handle.read(sUInt8.size)
+            # The frequency values are the sizes of their IDs.
+            offset += self.frequency.value
         
         for block in self.blocks.values():
-            block.fromStream(handle)
+            offset = block.fromBuffer(buf, offset, lazy)
+        
+        if lazy and offset > len(buf):
+            raise struct.error("Message {} is truncated".format(self.name))
+        
+        return offset
+    
+    def load(self, handle, readID = False):
+        start = handle.tell()
+        handle.seek(start + self.fromBuffer(handle.read(), 0, readID))
     
     def loads(self, data, verifyID = True):
-        handle = io.BytesIO(data)
-        self.load(handle, verifyID)
+        self.fromBuffer(data, 0, verifyID)
     
     def registerBlock(self, block):
         if block.name in self.blocks:
@@ -451,7 +615,11 @@ class MessageTemplate:
     def getMessage(self, name):
         return self.messages[name].copy()
     
-    def loadMessage(self, message):
+    def peekMessage(self, message):
+        """
+        Look up the template of an encoded message from its ID alone. The
+        returned message is shared and must not be modified.
+        """
         if message[0] == 0xFF:
             if message[1] == 0xFF:
                 mid, = sUInt32.unpack_from(message[0:4])
@@ -462,8 +630,15 @@ class MessageTemplate:
         else:
             mid = message[0]
         
-        msg = self.getMessage(mid)
-        msg.loads(message)
+        return self.messages[mid]
+    
+    def loadMessage(self, message, lazy = False):
+        """
+        Decode a message including its ID. In lazy mode only the block offsets
+        are recorded and parameters are decoded as they are accessed.
+        """
+        msg = self.peekMessage(message).copy()
+        msg.fromBuffer(message, 0, True, lazy)
         return msg
     
     @classmethod
@@ -661,6 +836,7 @@ class MessageTemplate:
                     # --- End parameter construction ---
                     
                 
+                mBlock.compile()
                 message.registerBlock(mBlock)
                 
             self.registerMessage(message)
@@ -0,0 +1,72 @@
+import bisect
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        buckets = {}
+        for bound, count in zip(self.bounds, self.counts):
+            buckets[bound] = count
+        buckets[float("inf")] = self.counts[-1]
+
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "buckets": buckets
+        }
+
+
+class CircuitMetrics:
+    """
+    Traffic counters of a circuit, split up by message name. Everything is a
+    plain integer increment so this can stay enabled.
+    """
+    # Upper bounds of the round trip time buckets, in seconds
+    RTT_BUCKETS = (0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 3.2)
+
+    def __init__(self):
+        self.packetsIn = 0
+        self.bytesIn = 0
+        self.packetsOut = 0
+        self.bytesOut = 0
+        self.reliableSent = 0
+        self.inbound = {}
+        self.outbound = {}
+        self.rtt = Histogram(self.RTT_BUCKETS)
+
+    def countIn(self, name, size):
+        counter = self.inbound.get(name)
+        if counter == None:
+            counter = self.inbound[name] = [0, 0]
+        counter[0] += 1
+        counter[1] += size
+
+    def countOut(self, name, size):
+        self.packetsOut += 1
+        self.bytesOut += size
+        counter = self.outbound.get(name)
+        if counter == None:
+            counter = self.outbound[name] = [0, 0]
+        counter[0] += 1
+        counter[1] += size
+
+    def snapshot(self):
+        return {
+            "packetsIn": self.packetsIn,
+            "bytesIn": self.bytesIn,
+            "packetsOut": self.packetsOut,
+            "bytesOut": self.bytesOut,
+            "reliableSent": self.reliableSent,
+            "messagesIn": {name: {"packets": c[0], "bytes": c[1]} for name, c in self.inbound.items()},
+            "messagesOut": {name: {"packets": c[0], "bytes": c[1]} for name, c in self.outbound.items()},
+            "rtt": self.rtt.snapshot()
+        }
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import struct
-import io
+from collections import deque
+from .zerocode import zeroEncode, zeroDecode
 
 # https://wiki.secondlife.com/wiki/Packet_Layout
 """
@@ -11,44 +12,6 @@ import io
  +-+-+-+-+----+--------+--------+--------+--------+--------+-----...-----+
 """
 
-def zeroEncode(buf):
-    output = io.BytesIO()
-    count = None
-    i = 0
-    l = len(buf)
-    count = 0
-    while i < l:
-        if buf[i] == 0:
-            count = 0
-            while i < l and buf[i] == 0:
-                count += 1
-                i += 1
-                if count == 255:
-                    output.write(bytes([0, 0xFF]))
-                    count = 0
-            if count != 0:
-                output.write(bytes([0, count]))
-        if i < l:
-            output.write(bytes([buf[i]]))
-        i += 1
-    
-    return output.getvalue()
-
-def zeroDecode(buf):
-    output = io.BytesIO()
-    count = None
-    i = 0
-    l = len(buf)
-    while i < l:
-        if buf[i] == 0:
-            i += 1
-            output.write(bytes(buf[i]))
-        else:
-            output.write(bytes([buf[i]]))
-        i += 1
-    
-    return output.getvalue()
-
 class Packet:
     MTU = 1400
     
@@ -66,7 +29,7 @@ class Packet:
         self.flags = flags or 0
         self.extra = extra or b""
         self.body = body or b""
-        self.acks = acks or []
+        self.acks = deque(acks or ())
     
     @property
     def reliable(self):
@@ -102,80 +65,67 @@ class Packet:
             self.flags &= ~self.FLAGS.ZEROCODE
     
     def toBytes(self):
-        output = io.BytesIO()
-        flags = self.flags
-        if len(self.acks) > 0:
-            flags = flags | self.FLAGS.ACK
+        output = bytearray(self.sPacketHeader.pack(self.flags & ~self.FLAGS.ACK, self.sequence, len(self.extra)))
+        output += self.extra
         
-        output.write(self.sPacketHeader.pack(flags, self.sequence, len(self.extra)))
-        output.write(self.extra)
-        
-        if flags & self.FLAGS.ZEROCODE:
-            output.write(zeroEncode(self.body))
+        if self.flags & self.FLAGS.ZEROCODE:
+            output += zeroEncode(self.body)
         else:
-            output.write(self.body)
+            output += self.body
         
-        if flags & self.FLAGS.ACK:
-            count = 0
-            while len(self.acks):
-                size = output.tell()
-                if size - 5 >= self.MTU:
-                    break
-                
-                if count >= 255:
-                    break
-                
-                output.write(self.sPacketAcks.pack(self.acks.pop(0)))
-                count += 1
-            
-            output.write(bytes([count]))
+        if self.appendAcks(output, self.acks):
+            output[0] |= self.FLAGS.ACK
         
-        return output.getvalue()
+        return bytes(output)
     
     def __bytes__(self):
-        return self.toByte()
+        return self.toBytes()
     
     @classmethod
-    def fromBytes(cls, data):
-        return cls.fromStream(io.BytesIO(data))
+    def appendAcks(cls, output, acks):
+        """
+        Append as many acks as fit within the MTU to a serialized packet, the
+        acks that were written are removed from the front of the deque.
+        The caller is responsible for setting the ACK flag.
+        """
+        count = min(len(acks), 255, (cls.MTU - len(output) - 1) // cls.sPacketAcks.size)
+        if count <= 0:
+            return 0
+        
+        popleft = acks.popleft
+        output += struct.pack(">{}I".format(count), *[popleft() for _ in range(count)])
+        output.append(count)
+        return count
     
     @classmethod
-    def fromStream(cls, f):
-        flags, seq, extra = cls.sPacketHeader.unpack_from(f.read(cls.sPacketHeader.size))
+    def fromBytes(cls, data):
+        # Everything is read straight out of the datagram, the body is only
+        # copied if it has to be zero decoded.
+        view = memoryview(data)
+        flags, seq, extra = cls.sPacketHeader.unpack_from(view)
         
+        bodyStart = cls.sPacketHeader.size + extra
         if extra > 0:
-            extra = f.read(extra)
+            extra = bytes(view[cls.sPacketHeader.size:bodyStart])
         else:
             extra = b""
         
-        bodyStart = f.tell()
-        
-        body = None
+        bodyEnd = len(view)
         acks = []
         if flags & cls.FLAGS.ACK:
-            f.seek(-1, io.SEEK_END)
-            ackCount, = f.read(1)
-            
-            f.seek(-(ackCount * cls.sPacketAcks.size) - 1, io.SEEK_END)
-            
-            bodyEnd = f.tell()
-            
-            acks = [None] * ackCount
-            for i in range(ackCount):
-                acks[i], = cls.sPacketAcks.unpack(f.read(cls.sPacketAcks.size))
+            ackCount = view[-1]
+            bodyEnd -= ackCount * cls.sPacketAcks.size + 1
+            if bodyEnd < bodyStart:
+                raise ValueError("Packet too short for {} acks".format(ackCount))
             
-            f.seek(bodyStart)
-            body = f.read(bodyEnd - bodyStart)
-            
-        else:
-            body = f.read()
+            acks = list(struct.unpack_from(">{}I".format(ackCount), view, bodyEnd))
         
+        body = view[bodyStart:bodyEnd]
         if flags & cls.FLAGS.ZEROCODE:
             body = zeroDecode(body)
         
         return cls(seq, body, flags = flags, acks = acks, extra = extra)
     
     @classmethod
-    def fromBytes(cls, data):
-        return cls.fromStream(io.BytesIO(data))
-    
+    def fromStream(cls, f):
+        return cls.fromBytes(f.read())
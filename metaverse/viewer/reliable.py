@@ -0,0 +1,173 @@
+import heapq
+from .packet import Packet
+
+class RTTEstimator:
+    """
+    Smoothed round trip time and retransmission timeout, as per RFC 6298.
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial = 1.0, minimum = 0.2, maximum = 5.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, sample):
+        if self.srtt == None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - sample)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * sample
+
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.minimum), self.maximum)
+
+
+class UnackedPacket:
+    __slots__ = ("sequence", "data", "sent", "retries", "deadline")
+
+    def __init__(self, sequence, data, sent, deadline):
+        self.sequence = sequence
+        self.data = data
+        self.sent = sent
+        self.retries = 0
+        self.deadline = deadline
+
+
+class ResendQueue:
+    """
+    Reliable packets waiting for an ack. Timeouts are kept in a heap so only
+    the packets that are due have to be looked at.
+    """
+    # Same as LL_DEFAULT_RELIABLE_RETRIES in the viewer
+    MAX_RETRIES = 3
+
+    def __init__(self, maxRetries = None):
+        self.rtt = RTTEstimator()
+        self.maxRetries = maxRetries if maxRetries != None else self.MAX_RETRIES
+        self.packets = {}
+        self.timeouts = []
+        self.resent = 0
+        self.lost = 0
+
+    def __len__(self):
+        return len(self.packets)
+
+    def __contains__(self, sequence):
+        return sequence in self.packets
+
+    def add(self, sequence, data, now):
+        entry = UnackedPacket(sequence, data, now, now + self.rtt.rto)
+        self.packets[sequence] = entry
+        heapq.heappush(self.timeouts, (entry.deadline, sequence))
+
+    def acknowledge(self, sequence, now):
+        """Remove an acked packet, returns the round trip time if it was sampled."""
+        entry = self.packets.pop(sequence, None)
+        if not entry:
+            return None
+
+        # Karn's algorithm: acks for resent packets are ambiguous
+        if entry.retries != 0:
+            return None
+
+        sample = now - entry.sent
+        self.rtt.update(sample)
+        return sample
+
+    def nextDeadline(self):
+        # Acked and rescheduled packets leave stale timeouts behind
+        while self.timeouts:
+            deadline, sequence = self.timeouts[0]
+            entry = self.packets.get(sequence)
+            if entry and entry.deadline == deadline:
+                return deadline
+            heapq.heappop(self.timeouts)
+
+        return None
+
+    def expire(self, now):
+        """
+        Collect the packets that timed out, flagged as resent and rescheduled
+        with exponential backoff. Packets out of retries are dropped.
+        """
+        due = []
+        while self.timeouts and self.timeouts[0][0] <= now:
+            deadline, sequence = heapq.heappop(self.timeouts)
+            entry = self.packets.get(sequence)
+            if not entry or entry.deadline != deadline:
+                continue
+
+            if self.retry(entry, now):
+                due.append(entry.data)
+
+        return due
+
+    def expireBefore(self, cutoff, now):
+        """
+        Like expire(), for the packets with a sequence number below cutoff
+        whether they timed out yet or not.
+        """
+        due = []
+        for entry in [entry for entry in self.packets.values() if entry.sequence < cutoff]:
+            if self.retry(entry, now):
+                due.append(entry.data)
+        return due
+
+    def retry(self, entry, now):
+        """Flag a packet as resent and reschedule it, False if it is out of retries."""
+        if entry.retries >= self.maxRetries:
+            del self.packets[entry.sequence]
+            self.lost += 1
+            return False
+
+        entry.retries += 1
+        entry.data[0] |= Packet.FLAGS.RESENT
+        entry.deadline = now + min(self.rtt.rto * (2 ** entry.retries), self.rtt.maximum)
+        heapq.heappush(self.timeouts, (entry.deadline, entry.sequence))
+        self.resent += 1
+        return True
+
+
+class SequenceWindow:
+    """
+    Remembers which of the most recent inbound sequence numbers have been
+    seen, as a bitset relative to the highest one.
+    """
+    def __init__(self, size = 1024):
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.highest = None
+        self.bits = 0
+
+    def check(self, sequence):
+        """
+        Mark a sequence number as seen. Returns True if it was seen before,
+        False if not and None if it is too old to tell.
+        """
+        if self.highest == None:
+            self.highest = sequence
+            self.bits = 1
+            return False
+
+        delta = sequence - self.highest
+        if delta > 0:
+            if delta >= self.size:
+                self.bits = 1
+            else:
+                self.bits = ((self.bits << delta) | 1) & self.mask
+            self.highest = sequence
+            return False
+
+        if -delta >= self.size:
+            return None
+
+        bit = 1 << -delta
+        if self.bits & bit:
+            return True
+
+        self.bits |= bit
+        return False
@@ -14,6 +14,13 @@ import logging
 logger = logging.getLogger(__name__)
 
 class Simulator(EventTarget):
+    # Messages handled by handleSystemMessages, these are always decoded.
+    # Acks and pings are taken care of by the circuit itself.
+    SYSTEM_MESSAGES = frozenset((
+        "RegionHandshake",
+        "DisableSimulator"
+    ))
+    
     def __init__(self, agent):
         super().__init__()
         self.agent = agent
@@ -30,6 +37,9 @@ class Simulator(EventTarget):
         self.eventQueue = eventqueue.EventQueue(self)
         self.eventQueue.on("Event", self.handleEvent)
         self.messageTemplate = messages.getDefaultTemplate()
+        # Skip decoding of messages no listener is interested in
+        self.filterMessages = True
+        self.filteredMessages = 0
     
     def __del__(self):
         try:
@@ -42,8 +52,10 @@ class Simulator(EventTarget):
     
     async def connect(self, host, circuitCode):
         self.host = host
-        self.circuit = await Circuit.create(host)
+        self.circuit = await Circuit.create(host, pool=self.agent.socketPool, circuitCode=circuitCode)
         self.circuit.on("Message", self.handleMessage)
+        self.circuit.on("Pong", self.handlePong)
+        self.circuit.setThrottles(self.agent.throttles)
         
         msg = self.messageTemplate.getMessage("UseCircuitCode")
         msg.CircuitCode.Code = circuitCode
@@ -51,27 +63,16 @@ class Simulator(EventTarget):
         msg.CircuitCode.ID = self.agent.agentId
         self.send(msg, True)
     
+    def handlePong(self, pingId):
+        self.lastMessage = time.time()
+        if pingId in self.pendingPings:
+            future = self.pendingPings[pingId]
+            if not future.done():
+                future.set_result(False)
+            del self.pendingPings[pingId]
+    
     async def handleSystemMessages(self, msg):
-        if msg.name == "PacketAck":
-            acks = []
-            for ack in msg.Packets:
-                acks.append(ack.ID)
-                
-            self.circuit.acknowledge(acks)
-        
-        elif msg.name == "StartPingCheck":
-            msg = self.messageTemplate.getMessage("CompletePingCheck")
-            msg.PingID.PingID = msg.PingID.PingID
-            self.send(msg)
-        
-        elif msg.name == "CompletePingCheck":
-            if msg.PingID.PingID in self.pendingPings:
-                future = self.pendingPings[msg.PingID.PingID]
-                if not future.done():
-                    future.set_result(False)
-                del self.pendingPings[msg.PingID.PingID]
-        
-        elif msg.name == "RegionHandshake":
+        if msg.name == "RegionHandshake":
             self.name = msg.RegionInfo.SimName.rstrip(b"\0").decode()
             self.owner = msg.RegionInfo.SimOwner
             self.id = msg.RegionInfo2.RegionID
@@ -92,7 +93,13 @@ class Simulator(EventTarget):
             return
         
         self.lastMessage = time.time()
-        msg = self.messageTemplate.loadMessage(body)
+        if self.filterMessages:
+            name = self.messageTemplate.peekMessage(body).name
+            if not self.wantsMessage(name):
+                self.filteredMessages += 1
+                return
+        
+        msg = self.messageTemplate.loadMessage(body, self.agent.lazyMessages)
         await self.handleSystemMessages(msg)
         
         # Don't break the whole script!
@@ -101,6 +108,9 @@ class Simulator(EventTarget):
         except Exception as e:
             traceback.print_exc()
     
+    def wantsMessage(self, name):
+        return name in self.SYSTEM_MESSAGES or self.hasListeners("Message", name=name)
+    
     async def handleEvent(self, name, body):
         try:
             await self.fire("Event", self, name, body)
@@ -111,22 +121,17 @@ class Simulator(EventTarget):
         if "Seed" not in Capabilities:
             return
         
-        seed = Capabilities.get("Seed", url)
+        seed = Capabilities.get("Seed", url, self.agent.http)
         self.capabilities = await seed.getCapabilities(Capabilities)
         self.eventQueue.start()
 
     async def sendAcks(self):
+        # The circuit flushes its acks on its own shortly after receiving
+        # packets, this just forces it to happen now.
         if len(self.circuit.acks) == 0:
             return False
         
-        msg = self.messageTemplate.getMessage("PacketAck")
-        for i in range(255):
-            if len(self.circuit.acks) > 0:
-                msg.Packets[i].ID = self.circuit.acks.pop(0)
-            else:
-                break
-        
-        self.send(msg)
+        self.circuit.flushAcks()
         return len(self.circuit.acks) > 0
         
 
@@ -158,6 +163,7 @@ class Simulator(EventTarget):
         self.pendingPings[msg.PingID.PingID] = future
 
         self.send(msg)
+        start = loop.time()
 
         try:
             await asyncio.wait_for(future, timeout=timeout)
@@ -166,8 +172,14 @@ class Simulator(EventTarget):
                 del self.pendingPings[msg.PingID.PingID]
             return False
         
+        self.circuit.metrics.rtt.add(loop.time() - start)
         return True
 
+    def getMetrics(self):
+        result = self.circuit.getMetrics() if self.circuit else {}
+        result["filtered"] = self.filteredMessages
+        return result
+    
     def close(self):
         self.eventQueue.close()
         self.circuit.close()
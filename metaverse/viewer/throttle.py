@@ -0,0 +1,127 @@
+import struct
+from enum import IntEnum
+from .packet import Packet
+
+class TokenBucket:
+    """
+    Bytes per second allowance. A packet may go out as long as there is any
+    allowance left, bigger packets put the bucket into debt.
+    """
+    # Seconds worth of allowance that can be saved up
+    BURST = 0.25
+
+    def __init__(self, rate = 0):
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0
+        self.last = None
+        self.setRate(rate)
+
+    def setRate(self, rate):
+        self.rate = rate
+        self.capacity = max(rate * self.BURST, Packet.MTU)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self, now):
+        if self.last != None:
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.capacity)
+        else:
+            self.tokens = self.capacity
+        self.last = now
+
+    def take(self, size, now):
+        # No rate means no limit
+        if self.rate <= 0:
+            return True
+
+        self.refill(now)
+        if self.tokens <= 0:
+            return False
+
+        self.tokens -= size
+        return True
+
+    def delay(self, now):
+        """Seconds until take() will succeed again."""
+        if self.rate <= 0:
+            return 0
+
+        self.refill(now)
+        if self.tokens > 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class Throttle:
+    """
+    Outbound pacing per AgentThrottle category. Rates are given in bits per
+    second, just like they are sent to the simulator.
+    """
+    class CATEGORY(IntEnum):
+        RESEND = 0
+        LAND = 1
+        WIND = 2
+        CLOUD = 3
+        TASK = 4
+        TEXTURE = 5
+        ASSET = 6
+
+    #http://wiki.secondlife.com/wiki/AgentThrottle
+    DEFAULTS = (
+        150000,  #Resend
+        170000,  #Land
+        34000,   #Wind
+        34000,   #Cloud
+        446000,  #Task
+        446000,  #Texture
+        220000   #Asset
+    )
+
+    sThrottles = struct.Struct("<7f")
+
+    # Messages that never wait, delaying these only makes things worse
+    UNTHROTTLED = frozenset((
+        "PacketAck",
+        "StartPingCheck",
+        "CompletePingCheck"
+    ))
+
+    # Anything not listed here counts towards TASK
+    CATEGORIES = {
+        "RequestImage": CATEGORY.TEXTURE,
+        "TransferRequest": CATEGORY.ASSET,
+        "TransferAbort": CATEGORY.ASSET,
+        "AssetUploadRequest": CATEGORY.ASSET,
+        "RequestXfer": CATEGORY.ASSET,
+        "SendXferPacket": CATEGORY.ASSET,
+        "ConfirmXferPacket": CATEGORY.ASSET,
+        "AbortXfer": CATEGORY.ASSET
+    }
+
+    def __init__(self, rates = None):
+        self.buckets = [TokenBucket() for _ in self.CATEGORY]
+        self.setRates(rates or self.DEFAULTS)
+
+    def setRates(self, rates):
+        for bucket, rate in zip(self.buckets, rates):
+            bucket.setRate(rate / 8)
+
+    def getRates(self):
+        return tuple(bucket.rate * 8 for bucket in self.buckets)
+
+    @classmethod
+    def pack(cls, rates = None):
+        """Throttle block of an AgentThrottle message."""
+        return cls.sThrottles.pack(*(rates or cls.DEFAULTS))
+
+    @classmethod
+    def classify(cls, name):
+        if name in cls.UNTHROTTLED:
+            return None
+        return cls.CATEGORIES.get(name, cls.CATEGORY.TASK)
+
+    def take(self, category, size, now):
+        return self.buckets[category].take(size, now)
+
+    def delay(self, category, now):
+        return self.buckets[category].delay(now)
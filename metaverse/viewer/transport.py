@@ -0,0 +1,174 @@
+import asyncio
+import socket
+
+import logging
+logger = logging.getLogger(__name__)
+
+# A simulator tells circuits apart by the address packets come from, so one
+# socket can only carry a single circuit per simulator. Circuits to different
+# simulators share sockets, circuits to the same simulator get spread over
+# the pool.
+
+class CircuitTransport:
+    """
+    Stands in for a datagram transport of a single circuit, sends to and
+    receives from one remote address through a shared socket.
+    """
+    def __init__(self, shared, host, circuitCode = None):
+        self.shared = shared
+        self.host = host
+        self.circuitCode = circuitCode
+        self.closing = False
+
+    def sendto(self, data, addr = None):
+        if not self.closing:
+            self.shared.transport.sendto(data, addr or self.host)
+
+    def is_closing(self):
+        return self.closing
+
+    def get_extra_info(self, name, default = None):
+        if name == "peername":
+            return self.host
+        return self.shared.transport.get_extra_info(name, default)
+
+    def close(self):
+        if self.closing:
+            return
+
+        self.closing = True
+        self.shared.detach(self.host)
+
+    def abort(self):
+        self.close()
+
+
+class SharedSocket(asyncio.DatagramProtocol):
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.transport = None
+        self.circuits = {}
+        self.unknown = 0
+
+    def __len__(self):
+        return len(self.circuits)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        entry = self.circuits.get(addr)
+        if not entry:
+            # Late packets of closed circuits, or someone poking at us
+            self.unknown += 1
+            return
+
+        entry[0].datagram_received(data, addr)
+
+    def error_received(self, exc):
+        # Unconnected sockets can't tell which destination this was about
+        logger.debug(f"Error on shared socket: {exc}")
+
+    def connection_lost(self, exc):
+        self.transport = None
+        circuits = self.circuits
+        self.circuits = {}
+        for circuit, _ in circuits.values():
+            circuit.connection_lost(exc)
+        self.pool.remove(self)
+
+    def attach(self, circuit, host, circuitCode = None):
+        transport = CircuitTransport(self, host, circuitCode)
+        self.circuits[host] = (circuit, transport)
+        self.pool.resize(self)
+        circuit.connection_made(transport)
+        return transport
+
+    def detach(self, host):
+        self.circuits.pop(host, None)
+
+        # Keep one socket around for the next circuit, close the other idle ones
+        if not self.circuits and self.transport and (not self.pool.sockets or self.pool.sockets[0] is not self):
+            self.pool.remove(self)
+            self.transport.close()
+
+
+class SocketPool:
+    """
+    UDP sockets shared by all circuits of a process. Receive buffers grow
+    with the number of circuits on a socket.
+    """
+    # Kernel receive buffer per circuit, and the most a socket will ask for
+    BUFFER_PER_CIRCUIT = 256 * 1024
+    BUFFER_MAX = 16 * 1024 * 1024
+
+    def __init__(self, bufferPerCircuit = None, bufferMax = None):
+        self.bufferPerCircuit = bufferPerCircuit or self.BUFFER_PER_CIRCUIT
+        self.bufferMax = bufferMax or self.BUFFER_MAX
+        self.sockets = []
+
+    def __len__(self):
+        return sum(len(shared) for shared in self.sockets)
+
+    async def attach(self, circuit, host, circuitCode = None, loop = None):
+        for shared in self.sockets:
+            if host not in shared.circuits:
+                break
+        else:
+            shared = await self.open(loop)
+
+        shared.attach(circuit, host, circuitCode)
+        return circuit
+
+    async def open(self, loop = None):
+        loop = loop or asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(("0.0.0.0", 0))
+        transport, shared = await loop.create_datagram_endpoint(
+            lambda: SharedSocket(self),
+            sock=sock)
+        self.sockets.append(shared)
+        return shared
+
+    def resize(self, shared):
+        size = min(self.bufferPerCircuit * max(len(shared.circuits), 1), self.bufferMax)
+        sock = shared.transport.get_extra_info("socket")
+        try:
+            if sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) < size:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        except OSError as e:
+            logger.warning(f"Could not resize socket receive buffer to {size}: {e}")
+
+    def remove(self, shared):
+        if shared in self.sockets:
+            self.sockets.remove(shared)
+
+    def getCircuit(self, host, circuitCode = None):
+        for shared in self.sockets:
+            entry = shared.circuits.get(host)
+            if entry and (circuitCode == None or entry[1].circuitCode == circuitCode):
+                return entry[0]
+        return None
+
+    def getMetrics(self):
+        return {
+            "sockets": len(self.sockets),
+            "circuits": len(self),
+            "unknown": sum(shared.unknown for shared in self.sockets)
+        }
+
+    def close(self):
+        for shared in list(self.sockets):
+            if shared.transport:
+                shared.transport.close()
+        self.sockets = []
+
+
+__defaultPool = None
+def getDefaultPool():
+    global __defaultPool
+    if not __defaultPool:
+        __defaultPool = SocketPool()
+    return __defaultPool
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import re
+
+# Zero coding replaces each run of null bytes with a single null byte followed
+# by the length of the run. Runs longer than 255 are split up.
+# The scanning is done by the regex engine so that Python only runs once per
+# run of zeros instead of once per byte.
+
+_zeroRun = re.compile(b"\x00+")
+_zeroCode = re.compile(b"\x00(.)", re.DOTALL)
+_runCodes = [b""] + [bytes((0, i)) for i in range(1, 256)]
+_zeros = [bytes(i) for i in range(256)]
+
+def _encodeRun(match):
+    count = match.end() - match.start()
+    if count < 256:
+        return _runCodes[count]
+
+    full = (count - 1) // 255
+    return b"\x00\xFF" * full + _runCodes[count - full * 255]
+
+def _decodeRun(match):
+    return _zeros[match.group(1)[0]]
+
+def zeroEncode(buf):
+    return _zeroRun.sub(_encodeRun, buf)
+
+def zeroDecode(buf):
+    return _zeroCode.sub(_decodeRun, buf)
+